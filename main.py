@@ -9,18 +9,17 @@ from utils.channel import (
     setup_logging,
     cleanup_logging,
     get_channel_data_cache_with_compare,
-    format_channel_url_info,
+    save_result_history,
+    ChannelStore,
 )
 from utils.tools import (
     update_file,
     get_pbar_remaining,
     get_ip_address,
-    convert_to_m3u,
     get_result_file_content,
-    process_nested_dict,
+    get_unique_candidates,
     format_interval,
     check_ipv6_support,
-    resource_path,
 )
 from updates.subscribe import get_channels_by_subscribe_urls
 from updates.multicast import get_channels_by_multicast
@@ -34,8 +33,6 @@ from time import time
 from flask import Flask, render_template_string
 import sys
 import atexit
-import pickle
-import copy
 
 app = Flask(__name__)
 
@@ -79,7 +76,7 @@ class UpdateSource:
         self.multicast_result = {}
         self.subscribe_result = {}
         self.online_search_result = {}
-        self.channel_data = {}
+        self.channel_data = ChannelStore()
         self.pbar = None
         self.total = 0
         self.start_time = None
@@ -126,14 +123,14 @@ class UpdateSource:
             )
 
     def get_urls_len(self, filter=False):
-        data = copy.deepcopy(self.channel_data)
-        if filter:
-            process_nested_dict(data, seen=set(), flag=r"cache:(.*)", force_str="!")
+        data = (
+            get_unique_candidates(self.channel_data) if filter else self.channel_data
+        )
         processed_urls = set(
-            url_info[0]
+            candidate.url
             for channel_obj in data.values()
-            for url_info_list in channel_obj.values()
-            for url_info in url_info_list
+            for info_list in channel_obj.values()
+            for candidate in info_list
         )
         return len(processed_urls)
 
@@ -160,7 +157,7 @@ class UpdateSource:
                     self.subscribe_result,
                     self.online_search_result,
                 )
-                channel_data_cache = copy.deepcopy(self.channel_data)
+                channel_data_cache = self.channel_data
                 ipv6_support = check_ipv6_support()
                 open_sort = config.open_sort
                 if open_sort:
@@ -179,8 +176,6 @@ class UpdateSource:
                         ipv6=ipv6_support,
                         callback=sort_callback,
                     )
-                else:
-                    format_channel_url_info(self.channel_data)
                 self.total = self.get_urls_len()
                 self.pbar = tqdm(total=self.total, desc="Writing")
                 self.start_time = time()
@@ -191,16 +186,12 @@ class UpdateSource:
                 )
                 self.pbar.close()
                 user_final_file = config.final_file
-                update_file(user_final_file, "output/result_new.txt")
                 if config.open_use_old_result:
                     if open_sort:
                         get_channel_data_cache_with_compare(
                             channel_data_cache, self.channel_data
                         )
-                    with open(
-                        resource_path("output/result_cache.pkl", persistent=True), "wb"
-                    ) as file:
-                        pickle.dump(channel_data_cache, file)
+                    save_result_history(channel_data_cache)
                 if open_sort:
                     user_log_file = "output/" + (
                         "user_result.log"
@@ -209,7 +200,6 @@ class UpdateSource:
                     )
                     update_file(user_log_file, "output/result_new.log", copy=True)
                     cleanup_logging()
-                convert_to_m3u()
                 total_time = format_interval(time() - main_start_time)
                 print(
                     f"🥳 Update completed! Total time spent: {total_time}. Please check the {user_final_file} file!"
@@ -9,7 +9,13 @@ from utils.config import config
 import utils.constants as constants
 from utils.retry import retry_func
 from utils.channel import format_channel_name
-from utils.tools import merge_objects, get_pbar_remaining, add_url_info, resource_path
+from utils.tools import (
+    merge_objects,
+    ResultAccumulator,
+    get_pbar_remaining,
+    add_url_info,
+    resource_path,
+)
 from updates.proxy import get_proxy, get_proxy_next
 from requests_custom.utils import get_source_requests, close_session
 from collections import defaultdict
@@ -77,7 +83,7 @@ async def get_channels_by_fofa(urls=None, multicast=False, callback=None):
         desc=f"Processing fofa for {'multicast' if multicast else 'hotel'}",
     )
     start_time = time()
-    fofa_results = {}
+    fofa_results = ResultAccumulator()
     mode_name = "组播" if multicast else "酒店"
     if callback:
         callback(
@@ -129,6 +135,7 @@ async def get_channels_by_fofa(urls=None, multicast=False, callback=None):
                 multicast_result = [(url, None, None) for url in urls]
                 results[region][type] = multicast_result
             else:
+                accumulator = ResultAccumulator()
                 with ThreadPoolExecutor(max_workers=100) as executor:
                     futures = [
                         executor.submit(
@@ -141,7 +148,8 @@ async def get_channels_by_fofa(urls=None, multicast=False, callback=None):
                         for url in urls
                     ]
                     for future in futures:
-                        results = merge_objects(results, future.result())
+                        accumulator.update(future.result())
+                results = accumulator.result()
             return results
         except ValueError as e:
             raise e
@@ -168,11 +176,12 @@ async def get_channels_by_fofa(urls=None, multicast=False, callback=None):
             for future in as_completed(futures):
                 result = future.result()
                 if result:
-                    fofa_results = merge_objects(fofa_results, result)
+                    fofa_results.update(result)
         except ValueError as e:
             if "Limited access to fofa page" in str(e):
                 for future in futures:
                     future.cancel()
+    fofa_results = fofa_results.result()
     if fofa_results:
         update_fofa_region_result_tmp(fofa_results, multicast=multicast)
     else:
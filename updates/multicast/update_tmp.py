@@ -7,9 +7,11 @@ from updates.subscribe import get_channels_by_subscribe_urls
 from driver.utils import get_soup_driver
 from utils.config import config
 import utils.constants as constants
-from utils.channel import format_channel_name, get_name_url
+from utils.channel import format_channel_name
 from utils.tools import get_pbar_remaining, resource_path
 import json
+import pickle
+import hashlib
 
 # import asyncio
 from requests import Session
@@ -99,6 +101,77 @@ def get_multicast_region_type_result_txt():
                     f.write(content)
 
 
+multicast_rtp_pattern = re.compile(constants.rtp_pattern)
+
+
+def get_multicast_rtp_file_data(content):
+    """
+    Get the channel name and rtp urls from the rtp file content
+    """
+    data = {}
+    for line in content.decode("utf-8").splitlines():
+        matcher = multicast_rtp_pattern.match(line)
+        if matcher:
+            url = matcher.group(2).strip()
+            if url:
+                data.setdefault(matcher.group(1).strip(), {})[url] = None
+    return {name: list(urls) for name, urls in data.items()}
+
+
+def load_multicast_rtp_cache():
+    """
+    Load the parsed rtp files of previous runs from the multicast rtp cache file
+    """
+    multicast_rtp_cache_path = resource_path(constants.multicast_rtp_cache_path)
+    if not os.path.exists(multicast_rtp_cache_path):
+        return {}
+    try:
+        with open(multicast_rtp_cache_path, "rb") as file:
+            return pickle.load(file)
+    except Exception:
+        return {}
+
+
+def save_multicast_rtp_cache(cache):
+    """
+    Save the parsed rtp files to the multicast rtp cache file
+    """
+    multicast_rtp_cache_path = resource_path(
+        constants.multicast_rtp_cache_path, persistent=True
+    )
+    os.makedirs(os.path.dirname(multicast_rtp_cache_path), exist_ok=True)
+    tmp_path = f"{multicast_rtp_cache_path}.tmp"
+    with open(tmp_path, "wb") as file:
+        pickle.dump(cache, file, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, multicast_rtp_cache_path)
+
+
+def get_multicast_rtp_data(path, cache):
+    """
+    Get the parsed data of the rtp file, the file is parsed again only when its
+    mtime and size and content hash are changed, return whether the cache is changed
+    """
+    filename = os.path.basename(path)
+    stat = os.stat(path)
+    cached = cache.get(filename)
+    if cached and (cached["mtime"], cached["size"]) == (stat.st_mtime_ns, stat.st_size):
+        return cached["data"], False
+    with open(path, "rb") as f:
+        content = f.read()
+    content_hash = hashlib.md5(content).hexdigest()
+    if cached and cached["hash"] == content_hash:
+        data = cached["data"]
+    else:
+        data = get_multicast_rtp_file_data(content)
+    cache[filename] = {
+        "mtime": stat.st_mtime_ns,
+        "size": stat.st_size,
+        "hash": content_hash,
+        "data": data,
+    }
+    return data, True
+
+
 def get_multicast_region_result_by_rtp_txt(callback=None):
     """
     Get multicast region result by rtp txt
@@ -121,21 +194,21 @@ def get_multicast_region_result_by_rtp_txt(callback=None):
         callback(f"正在读取本地组播数据, 共{total_files}个文件", 0)
 
     pbar = tqdm(total=total_files, desc="Loading local multicast rtp files")
-    multicast_result = defaultdict(lambda: defaultdict(lambda: defaultdict(list)))
+    multicast_result = defaultdict(lambda: defaultdict(lambda: defaultdict(dict)))
     start_time = time()
+    cache = load_multicast_rtp_cache()
+    cache_changed = False
 
     for filename in rtp_file_list:
         region, _, type = filename.partition("_")
-        with open(
-            os.path.join(rtp_path, f"{filename}.txt"), "r", encoding="utf-8"
-        ) as f:
-            for line in f:
-                name_url = get_name_url(line, pattern=constants.rtp_pattern)
-                if name_url and name_url[0]:
-                    channel_name = format_channel_name(name_url[0]["name"])
-                    url = name_url[0]["url"]
-                    if url not in multicast_result[channel_name][region][type]:
-                        multicast_result[channel_name][region][type].append(url)
+        data, changed = get_multicast_rtp_data(
+            os.path.join(rtp_path, f"{filename}.txt"), cache
+        )
+        cache_changed = cache_changed or changed
+        for name, urls in data.items():
+            multicast_result[format_channel_name(name)][region][type].update(
+                dict.fromkeys(urls)
+            )
         pbar.update()
         if callback:
             remaining_files = total_files - pbar.n
@@ -145,15 +218,17 @@ def get_multicast_region_result_by_rtp_txt(callback=None):
                 int((pbar.n / total_files) * 100),
             )
 
-    with open(
-        resource_path("updates/multicast/multicast_region_result.json"),
-        "w",
-        encoding="utf-8",
-    ) as f:
-        json.dump(multicast_result, f, ensure_ascii=False, indent=4)
+    if cache_changed:
+        save_multicast_rtp_cache(cache)
 
     pbar.close()
-    return multicast_result
+    return {
+        name: {
+            region: {type: list(urls) for type, urls in types.items()}
+            for region, types in regions.items()
+        }
+        for name, regions in multicast_result.items()
+    }
 
 
 if __name__ == "__main__":
@@ -1,20 +1,60 @@
 import utils.constants as constants
 from tqdm.asyncio import tqdm_asyncio
 from time import time
-from requests import Session, exceptions
+from aiohttp import ClientSession, ClientTimeout, TCPConnector
+import asyncio
+import codecs
+import hashlib
+import os
+import pickle
 from utils.config import config
-import utils.constants as constants
-from utils.retry import retry_func
-from utils.channel import get_name_url, format_channel_name
+from utils.retry import retry_async_func
+from utils.channel import ChannelLineParser, format_channel_name
 from utils.tools import (
-    merge_objects,
+    ResultAccumulator,
     get_pbar_remaining,
+    resource_path,
     format_url_with_cache,
     add_url_info,
 )
-from concurrent.futures import ThreadPoolExecutor
 from collections import defaultdict
 
+subscribe_cache = {}
+
+
+def load_subscribe_cache():
+    """
+    Load the response validators and parsed records of subscribe sources
+    """
+    subscribe_cache_path = resource_path(constants.subscribe_cache_path)
+    if subscribe_cache or not os.path.exists(subscribe_cache_path):
+        return
+    try:
+        with open(subscribe_cache_path, "rb") as file:
+            cache = pickle.load(file)
+    except Exception:
+        return
+    expire = time() - constants.subscribe_cache_expire
+    subscribe_cache.update(
+        (key, value)
+        for key, value in cache.items()
+        if "data" in value and value["time"] > expire
+    )
+
+
+def save_subscribe_cache():
+    """
+    Save the response validators and parsed records of subscribe sources
+    """
+    subscribe_cache_path = resource_path(
+        constants.subscribe_cache_path, persistent=True
+    )
+    os.makedirs(os.path.dirname(subscribe_cache_path), exist_ok=True)
+    tmp_path = f"{subscribe_cache_path}.tmp"
+    with open(tmp_path, "wb") as file:
+        pickle.dump(subscribe_cache, file)
+    os.replace(tmp_path, subscribe_cache_path)
+
 
 async def get_channels_by_subscribe_urls(
     urls,
@@ -27,7 +67,7 @@ async def get_channels_by_subscribe_urls(
     """
     Get the channels by subscribe urls
     """
-    subscribe_results = {}
+    subscribe_results = ResultAccumulator()
     subscribe_urls_len = len(urls if urls else config.subscribe_urls)
     pbar = tqdm_asyncio(
         total=subscribe_urls_len,
@@ -40,78 +80,117 @@ async def get_channels_by_subscribe_urls(
             f"正在获取{mode_name}源, 共{subscribe_urls_len}个{mode_name}源",
             0,
         )
-    session = Session()
+    session = ClientSession(
+        connector=TCPConnector(
+            limit=config.subscribe_connection_limit,
+            limit_per_host=config.subscribe_limit_per_host,
+            ttl_dns_cache=constants.sort_dns_cache_ttl,
+        ),
+        timeout=ClientTimeout(
+            sock_connect=config.request_timeout, sock_read=config.request_timeout
+        ),
+        trust_env=True,
+    )
     hotel_name = constants.origin_map["hotel"]
     multicast_name = constants.origin_map["multicast"]
     subscribe_name = constants.origin_map["subscribe"]
 
-    def process_subscribe_channels(subscribe_info):
+    if config.open_subscribe_cache:
+        load_subscribe_cache()
+
+    async def get_subscribe_data(subscribe_url, cache=None):
+        headers = {}
+        if cache:
+            if cache["etag"]:
+                headers["If-None-Match"] = cache["etag"]
+            if cache["last_modified"]:
+                headers["If-Modified-Since"] = cache["last_modified"]
+        async with session.get(subscribe_url, headers=headers) as response:
+            if response.status == 304 and cache:
+                return None, cache["hash"], None
+            response.raise_for_status()
+            validators = {
+                "etag": response.headers.get("ETag"),
+                "last_modified": response.headers.get("Last-Modified"),
+            }
+            decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+            parser = ChannelLineParser()
+            content_hash = hashlib.md5()
+            data = []
+            async for chunk in response.content.iter_chunked(
+                constants.subscribe_chunk_size
+            ):
+                content_hash.update(chunk)
+                data.extend(parser.feed(decoder.decode(chunk)))
+            data.extend(parser.feed(decoder.decode(b"", final=True)))
+            data.extend(parser.close())
+            return data, content_hash.hexdigest(), validators
+
+    async def process_subscribe_channels(subscribe_info):
         if (multicast or hotel) and isinstance(subscribe_info, dict):
             region = subscribe_info.get("region")
             type = subscribe_info.get("type", "")
             subscribe_url = subscribe_info.get("url")
         else:
+            region = type = None
             subscribe_url = subscribe_info
         channels = defaultdict(lambda: defaultdict(lambda: defaultdict(list)))
+        cache_key = (subscribe_url, mode_name, region, type)
+        cache = subscribe_cache.get(cache_key) if config.open_subscribe_cache else None
         try:
-            response = None
+            data = content_hash = validators = None
             try:
-                response = (
-                    retry_func(
-                        lambda: session.get(
-                            subscribe_url, timeout=config.request_timeout
-                        ),
+                data, content_hash, validators = (
+                    await retry_async_func(
+                        lambda: get_subscribe_data(subscribe_url, cache),
                         name=subscribe_url,
                     )
                     if retry
-                    else session.get(subscribe_url, timeout=config.request_timeout)
+                    else await get_subscribe_data(subscribe_url, cache)
                 )
-            except exceptions.Timeout:
+            except asyncio.TimeoutError:
                 print(f"Timeout on subscribe: {subscribe_url}")
-            if response:
-                response.encoding = "utf-8"
-                content = response.text
-                data = get_name_url(
-                    content,
-                    pattern=(
-                        constants.m3u_pattern
-                        if "#EXTM3U" in content
-                        else constants.txt_pattern
-                    ),
-                    multiline=True,
-                )
-                for item in data:
-                    name = item["name"]
-                    url = item["url"]
-                    if name and url:
-                        url = url.partition("$")[0]
-                        if not multicast:
-                            info = (
-                                f"{region}{hotel_name}"
-                                if hotel
-                                else (
-                                    f"{multicast_name}"
-                                    if "/rtp/" in url
-                                    else f"{subscribe_name}"
-                                )
+            if cache and content_hash == cache["hash"]:
+                data = cache["data"]
+                if validators:
+                    cache.update(validators)
+                cache["time"] = time()
+            elif data and config.open_subscribe_cache:
+                subscribe_cache[cache_key] = {
+                    **validators,
+                    "hash": content_hash,
+                    "data": data,
+                    "time": time(),
+                }
+            if data:
+                for name, url in data:
+                    if not multicast:
+                        info = (
+                            f"{region}{hotel_name}"
+                            if hotel
+                            else (
+                                f"{multicast_name}"
+                                if "/rtp/" in url
+                                else f"{subscribe_name}"
                             )
-                            url = add_url_info(url, info)
-                        url = format_url_with_cache(
-                            url, cache=subscribe_url if (multicast or hotel) else None
                         )
-                        value = url if multicast else (url, None, None)
-                        name = format_channel_name(name)
-                        if name in channels:
-                            if multicast:
-                                if value not in channels[name][region][type]:
-                                    channels[name][region][type].append(value)
-                            elif value not in channels[name]:
-                                channels[name].append(value)
+                        url = add_url_info(url, info)
+                    url = format_url_with_cache(
+                        url, cache=subscribe_url if (multicast or hotel) else None
+                    )
+                    value = url if multicast else (url, None, None)
+                    name = format_channel_name(name)
+                    if name in channels:
+                        if multicast:
+                            if value not in channels[name][region][type]:
+                                channels[name][region][type].append(value)
+                        elif value not in channels[name]:
+                            channels[name].append(value)
+                    else:
+                        if multicast:
+                            channels[name][region][type] = [value]
                         else:
-                            if multicast:
-                                channels[name][region][type] = [value]
-                            else:
-                                channels[name] = [value]
+                            channels[name] = [value]
         except Exception as e:
             if error_print:
                 print(f"Error on {subscribe_url}: {e}")
@@ -125,13 +204,18 @@ async def get_channels_by_subscribe_urls(
                 )
             return channels
 
-    with ThreadPoolExecutor(max_workers=100) as executor:
-        futures = [
-            executor.submit(process_subscribe_channels, subscribe_url)
-            for subscribe_url in (urls if urls else config.subscribe_urls)
-        ]
-        for future in futures:
-            subscribe_results = merge_objects(subscribe_results, future.result())
-    session.close()
+    try:
+        results = await asyncio.gather(
+            *(
+                process_subscribe_channels(subscribe_url)
+                for subscribe_url in (urls if urls else config.subscribe_urls)
+            )
+        )
+    finally:
+        await session.close()
+        if config.open_subscribe_cache:
+            save_subscribe_cache()
+    for result in results:
+        subscribe_results.update(result)
     pbar.close()
-    return subscribe_results
+    return subscribe_results.result()
@@ -1,30 +1,42 @@
 from utils.config import config
 import utils.constants as constants
 from utils.tools import (
-    check_url_by_patterns,
+    check_candidate_by_patterns,
+    check_by_url_keywords_blacklist,
+    check_ipv_type,
+    is_ipv6,
     get_total_urls_from_info_list,
-    process_nested_dict,
-    add_url_info,
-    remove_cache_info,
     resource_path,
-    write_content_into_txt,
+    ResultWriter,
+    Candidate,
+    get_unique_candidates,
 )
 from utils.speed import (
-    sort_urls_by_speed_and_resolution,
+    sort_channel_data_by_speed,
     is_ffmpeg_installed,
     speed_cache,
+    get_speed_session,
+    close_speed_session,
+    filter_by_connect_speed,
+    filter_by_udpxy_status,
+    get_host_samples,
+    update_host_speed_cache,
+    check_host_candidates,
+    load_speed_cache,
+    save_speed_cache,
 )
 import os
-from collections import defaultdict
 import re
 from bs4 import NavigableString
 import logging
 from logging.handlers import RotatingFileHandler
 from opencc import OpenCC
-import asyncio
+import threading
+from functools import lru_cache
 import base64
 import pickle
-import copy
+import sqlite3
+from contextlib import closing
 import datetime
 
 handler = None
@@ -72,6 +84,64 @@ def get_name_url(content, pattern, multiline=False, check_url=True):
     return channels
 
 
+channel_url_pattern = re.compile(constants.url_pattern)
+
+channel_name_separator_pattern = re.compile(r"[,，]")
+
+
+class ChannelLineParser:
+    """
+    Parse the TXT or M3U channel content line by line as it arrives, yield the
+    (name, url) records with the url info suffix removed
+    """
+
+    def __init__(self):
+        self.buffer = ""
+        self.extinf_name = None
+
+    def get_url(self, text):
+        match = channel_url_pattern.match(text.strip())
+        return match.group().partition("$")[0] if match else None
+
+    def parse_line(self, line):
+        line = line.strip()
+        if not line:
+            return None
+        if line.startswith("#"):
+            if line.startswith("#EXTINF"):
+                parts = channel_name_separator_pattern.split(line, 1)
+                self.extinf_name = parts[1].strip() if len(parts) > 1 else None
+            return None
+        if self.extinf_name is not None:
+            name, self.extinf_name = self.extinf_name, None
+            url = self.get_url(line)
+        else:
+            parts = channel_name_separator_pattern.split(line, 1)
+            if len(parts) < 2:
+                return None
+            name, value = parts[0].strip(), parts[1]
+            if "#genre#" in value:
+                return None
+            url = self.get_url(value)
+        return (name, url) if name and url else None
+
+    def feed(self, text):
+        """
+        Feed the text and parse the complete lines
+        """
+        lines = (self.buffer + text).split("\n")
+        self.buffer = lines.pop()
+        return [record for record in map(self.parse_line, lines) if record]
+
+    def close(self):
+        """
+        Parse the remaining line
+        """
+        record = self.parse_line(self.buffer)
+        self.buffer = ""
+        return [record] if record else []
+
+
 def get_channel_data_from_file(channels, file, use_old):
     """
     Get the channel data from the file
@@ -89,17 +159,12 @@ def get_channel_data_from_file(channels, file, use_old):
             if name_url and name_url[0]:
                 name = name_url[0]["name"]
                 url = name_url[0]["url"]
-                category_dict = channels[current_category]
-                if name not in category_dict:
-                    category_dict[name] = []
+                channels.get_info_list(current_category, name)
                 if use_old and url:
-                    info = url.partition("$")[2]
-                    origin = None
-                    if info and info.startswith("!"):
-                        origin = "important"
-                    data = (url, None, None, origin)
-                    if data not in category_dict[name]:
-                        category_dict[name].append(data)
+                    candidate = Candidate.from_info((url, None, None))
+                    if candidate.important:
+                        candidate.origin = "important"
+                    channels.add_info(current_category, name, candidate)
     return channels
 
 
@@ -108,7 +173,7 @@ def get_channel_items():
     Get the channel items from the source file
     """
     user_source_file = resource_path(config.source_file)
-    channels = defaultdict(lambda: defaultdict(list))
+    channels = ChannelStore()
 
     if os.path.exists(user_source_file):
         with open(user_source_file, "r", encoding="utf-8") as file:
@@ -117,41 +182,282 @@ def get_channel_items():
             )
 
     if config.open_use_old_result:
-        result_cache_path = resource_path("output/result_cache.pkl")
-        if os.path.exists(result_cache_path):
-            with open(result_cache_path, "rb") as file:
-                old_result = pickle.load(file)
-                for cate, data in channels.items():
-                    if cate in old_result:
-                        for name, info_list in data.items():
-                            urls = [
-                                item[0].partition("$")[0]
-                                for item in info_list
-                                if item[0]
-                            ]
-                            if name in old_result[cate]:
-                                for info in old_result[cate][name]:
-                                    if info:
-                                        pure_url = info[0].partition("$")[0]
-                                        if pure_url not in urls:
-                                            channels[cate][name].append(info)
+        load_result_history(channels)
     return channels
 
 
+def get_result_history_connection():
+    """
+    Get the connection of the result history store, the history of the old
+    result cache file is migrated when the store is created
+    """
+    result_history_path = resource_path(
+        constants.result_history_path, persistent=True
+    )
+    os.makedirs(os.path.dirname(result_history_path), exist_ok=True)
+    created = not os.path.exists(result_history_path)
+    connection = sqlite3.connect(result_history_path)
+    with connection:
+        connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS result_history (
+                category TEXT NOT NULL,
+                name TEXT NOT NULL,
+                url TEXT NOT NULL,
+                info TEXT,
+                cache TEXT,
+                date TEXT,
+                resolution TEXT,
+                origin TEXT,
+                important INTEGER NOT NULL DEFAULT 0,
+                position INTEGER NOT NULL DEFAULT 0,
+                last_run INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (category, name, url)
+            )
+            """
+        )
+        connection.execute(
+            "CREATE INDEX IF NOT EXISTS result_history_last_run "
+            "ON result_history (last_run)"
+        )
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS result_history_meta "
+            "(key TEXT PRIMARY KEY, value INTEGER)"
+        )
+    result_cache_path = resource_path(constants.result_cache_path)
+    if created and os.path.exists(result_cache_path):
+        try:
+            with open(result_cache_path, "rb") as file:
+                update_result_history(connection, pickle.load(file))
+        except Exception as e:
+            print(f"Error on migrating the result cache: {e}")
+    return connection
+
+
+def load_result_history(channels):
+    """
+    Load the result history of the channels into the channel store
+    """
+    with closing(get_result_history_connection()) as connection:
+        for cate, channel_obj in channels.items():
+            for name in channel_obj:
+                for *fields, important in connection.execute(
+                    "SELECT url, info, cache, date, resolution, origin, important "
+                    "FROM result_history WHERE category = ? AND name = ? "
+                    "ORDER BY position",
+                    (cate, name),
+                ):
+                    channels.add_info(
+                        cate, name, Candidate(*fields, important=bool(important))
+                    )
+
+
+def update_result_history(connection, data):
+    """
+    Update the result history with the channel data of this run, the history of
+    each channel in the data is replaced, the channels not seen for a number of
+    runs are removed
+    """
+    with connection:
+        row = connection.execute(
+            "SELECT value FROM result_history_meta WHERE key = 'run'"
+        ).fetchone()
+        run = (row[0] if row else 0) + 1
+        connection.execute(
+            "INSERT OR REPLACE INTO result_history_meta (key, value) VALUES ('run', ?)",
+            (run,),
+        )
+        for cate, channel_obj in data.items():
+            for name, info_list in channel_obj.items():
+                candidates = [
+                    Candidate.from_info(info)
+                    for info in info_list
+                    if isinstance(info, Candidate) or (info and info[0])
+                ]
+                connection.executemany(
+                    """
+                    INSERT INTO result_history (
+                        category, name, url, info, cache, date, resolution,
+                        origin, important, position, last_run
+                    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                    ON CONFLICT (category, name, url) DO UPDATE SET
+                        info = excluded.info,
+                        cache = excluded.cache,
+                        date = excluded.date,
+                        resolution = excluded.resolution,
+                        origin = excluded.origin,
+                        important = excluded.important,
+                        position = excluded.position,
+                        last_run = excluded.last_run
+                    """,
+                    (
+                        (
+                            cate,
+                            name,
+                            candidate.url,
+                            candidate.info,
+                            candidate.cache,
+                            candidate.date,
+                            candidate.resolution,
+                            candidate.origin,
+                            int(candidate.important),
+                            position,
+                            run,
+                        )
+                        for position, candidate in enumerate(candidates)
+                    ),
+                )
+                connection.execute(
+                    "DELETE FROM result_history "
+                    "WHERE category = ? AND name = ? AND last_run < ?",
+                    (cate, name, run),
+                )
+        connection.execute(
+            "DELETE FROM result_history WHERE last_run <= ?",
+            (run - constants.result_history_expire_runs,),
+        )
+
+
+def save_result_history(data):
+    """
+    Save the channel data of this run to the result history store
+    """
+    with closing(get_result_history_connection()) as connection:
+        update_result_history(connection, data)
+
+
+def get_replace_stages(replace_dict):
+    """
+    Get the replace stages of the replace dict, each stage is replaced in a
+    single pass, a new stage starts when a key contains the new value of a
+    previous key in the stage
+    """
+    stages = []
+    stage = {}
+    for old, new in replace_dict.items():
+        if any(value in old for value in stage.values()):
+            stages.append(stage)
+            stage = {}
+        stage[old] = new
+    if stage:
+        stages.append(stage)
+    return [
+        (
+            re.compile(
+                "|".join(map(re.escape, sorted(stage, key=len, reverse=True)))
+            ),
+            stage,
+        )
+        for stage in stages
+    ]
+
+
+region_prefix_pattern = re.compile(
+    "|".join(
+        f"{re.escape(region)}｜" for region in dict.fromkeys(constants.region_list)
+    )
+)
+
+channel_name_sub_pattern = re.compile(constants.sub_pattern)
+
+channel_name_replace_stages = get_replace_stages(constants.replace_dict)
+
+channel_name_converter = None
+
+channel_name_converter_lock = threading.Lock()
+
+
+def convert_channel_name(name):
+    """
+    Convert the channel name to simplified chinese with the shared converter
+    """
+    global channel_name_converter
+    with channel_name_converter_lock:
+        if channel_name_converter is None:
+            channel_name_converter = OpenCC("t2s")
+        return channel_name_converter.convert(name)
+
+
+@lru_cache(maxsize=constants.channel_name_cache_size)
+def normalize_channel_name(name):
+    """
+    Normalize the channel name with sub and replace and lower
+    """
+    name = convert_channel_name(name)
+    name = region_prefix_pattern.sub("", name)
+    name = channel_name_sub_pattern.sub("", name)
+    for pattern, stage in channel_name_replace_stages:
+        name = pattern.sub(lambda match: stage[match.group()], name)
+    return name.lower()
+
+
+channel_alias_index = None
+
+channel_alias_index_lock = threading.Lock()
+
+
+def get_channel_alias_list():
+    """
+    Get the channel alias list of the source file and the alias file, each item
+    is the canonical name with its aliases
+    """
+    alias_list = []
+    user_source_file = resource_path(config.source_file)
+    if os.path.exists(user_source_file):
+        with open(user_source_file, "r", encoding="utf-8") as file:
+            for line in file:
+                line = line.strip()
+                if "#genre#" in line:
+                    continue
+                name_url = get_name_url(
+                    line, pattern=constants.demo_txt_pattern, check_url=False
+                )
+                if name_url and name_url[0]["name"]:
+                    alias_list.append((name_url[0]["name"], []))
+    user_alias_file = resource_path(config.alias_file)
+    if os.path.exists(user_alias_file):
+        with open(user_alias_file, "r", encoding="utf-8") as file:
+            for line in file:
+                line = line.strip()
+                if line and not line.startswith("#"):
+                    name, *aliases = [item.strip() for item in line.split(",")]
+                    if name:
+                        alias_list.append((name, aliases))
+    return alias_list
+
+
+def get_channel_alias_index():
+    """
+    Get the alias index mapping the normalized aliases to the canonical name,
+    the source file names are canonical and never redirected
+    """
+    global channel_alias_index
+    with channel_alias_index_lock:
+        if channel_alias_index is None:
+            index = {}
+            alias_list = get_channel_alias_list()
+            for name, _ in alias_list:
+                key = normalize_channel_name(name)
+                index[key] = key
+            for name, aliases in alias_list:
+                key = normalize_channel_name(name)
+                key = index.get(key, key)
+                for alias in aliases:
+                    if alias:
+                        index.setdefault(normalize_channel_name(alias), key)
+            channel_alias_index = index
+        return channel_alias_index
+
+
 def format_channel_name(name):
     """
-    Format the channel name with sub and replace and lower
+    Format the channel name with sub and replace and lower, then map it to the
+    canonical name by the alias index
     """
     if config.open_keep_all:
         return name
-    cc = OpenCC("t2s")
-    name = cc.convert(name)
-    for region in constants.region_list:
-        name = name.replace(f"{region}｜", "")
-    name = re.sub(constants.sub_pattern, "", name)
-    for old, new in constants.replace_dict.items():
-        name = name.replace(old, new)
-    return name.lower()
+    key = normalize_channel_name(name)
+    return get_channel_alias_index().get(key, key)
 
 
 def channel_name_is_equal(name1, name2):
@@ -160,9 +466,7 @@ def channel_name_is_equal(name1, name2):
     """
     if config.open_keep_all:
         return True
-    name1_format = format_channel_name(name1)
-    name2_format = format_channel_name(name2)
-    return name1_format == name2_format
+    return format_channel_name(name1) == format_channel_name(name2)
 
 
 def get_channel_results_by_name(name, data):
@@ -188,14 +492,18 @@ def get_element_child_text_list(element, child_name):
     return text_list
 
 
+multicast_ip_pattern = re.compile(
+    r"rtp://((\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3})(?::(\d+))?)"
+)
+
+
 def get_multicast_ip_list(urls):
     """
     Get the multicast ip list from urls
     """
     ip_list = []
     for url in urls:
-        pattern = r"rtp://((\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3})(?::(\d+))?)"
-        matcher = re.search(pattern, url)
+        matcher = multicast_ip_pattern.search(url)
         if matcher:
             ip_list.append(matcher.group(1))
     return ip_list
@@ -246,38 +554,83 @@ def get_channel_multicast_region_type_list(result):
     return list(region_type_list)
 
 
+class MulticastCandidateList:
+    """
+    Candidates of the channel synthesized from the multicast ips and the udpxy
+    hosts of each region and type, generated lazily as they are appended, the
+    hosts are checked by patterns already and each url by the keywords blacklist
+    """
+
+    def __init__(self, groups):
+        self.groups = groups
+
+    def __len__(self):
+        return sum(len(ips) * len(hosts) for _, ips, hosts in self.groups)
+
+    def __iter__(self):
+        open_sort = config.open_sort
+        check_blacklist = bool(config.url_keywords_blacklist)
+        for info, ips, hosts in self.groups:
+            for ip in ips:
+                for host, date, resolution, ipv6 in hosts:
+                    url = f"http://{host}/rtp/{ip}"
+                    if check_blacklist and not check_by_url_keywords_blacklist(url):
+                        continue
+                    yield Candidate(
+                        url,
+                        info=info,
+                        cache=host if open_sort else None,
+                        date=date,
+                        resolution=resolution,
+                        origin="multicast",
+                        ipv6=ipv6,
+                    )
+
+
+def get_multicast_host_list(hosts):
+    """
+    Get the udpxy host list that matches the patterns, with the ipv6 check result
+    """
+    host_list = []
+    for host, date, resolution in hosts:
+        ipv6 = is_ipv6(f"http://{host}/")
+        if check_ipv_type(ipv6) and check_by_url_keywords_blacklist(
+            f"http://{host}/rtp/"
+        ):
+            host_list.append((host, date, resolution, ipv6))
+    return host_list
+
+
 def get_channel_multicast_result(result, search_result):
     """
     Get the channel multicast info result by result and search result
     """
     info_result = {}
     multicast_name = constants.origin_map["multicast"]
+    host_lists = {}
     for name, result_obj in result.items():
-        info_list = [
-            (
-                (
-                    add_url_info(
-                        f"http://{url}/rtp/{ip}",
-                        f"{result_region}{result_type}{multicast_name}|cache:{url}",
+        groups = []
+        for result_region, result_types in result_obj.items():
+            if result_region not in search_result:
+                continue
+            for result_type, result_type_urls in result_types.items():
+                if result_type not in search_result[result_region]:
+                    continue
+                key = (result_region, result_type)
+                if key not in host_lists:
+                    host_lists[key] = get_multicast_host_list(
+                        search_result[result_region][result_type]
                     )
-                    if config.open_sort
-                    else add_url_info(
-                        f"http://{url}/rtp/{ip}",
-                        f"{result_region}{result_type}{multicast_name}",
+                ips = get_multicast_ip_list(result_type_urls)
+                if ips and host_lists[key]:
+                    groups.append(
+                        (
+                            f"{result_region}{result_type}{multicast_name}",
+                            ips,
+                            host_lists[key],
+                        )
                     )
-                ),
-                date,
-                resolution,
-            )
-            for result_region, result_types in result_obj.items()
-            if result_region in search_result
-            for result_type, result_type_urls in result_types.items()
-            if result_type in search_result[result_region]
-            for ip in get_multicast_ip_list(result_type_urls) or []
-            for url, date, resolution in search_result[result_region][result_type]
-            if check_url_by_patterns(f"http://{url}/rtp/{ip}")
-        ]
-        info_result[name] = info_list
+        info_result[name] = MulticastCandidateList(groups)
     return info_result
 
 
@@ -288,6 +641,7 @@ def get_results_from_soup(soup, name):
     results = []
     if not soup.descendants:
         return results
+    key = format_channel_name(name)
     for element in soup.descendants:
         if isinstance(element, NavigableString):
             text = element.get_text(strip=True)
@@ -298,7 +652,10 @@ def get_results_from_soup(soup, name):
                     name_element = url_element.find_previous_sibling()
                     if name_element:
                         channel_name = name_element.get_text(strip=True)
-                        if channel_name_is_equal(name, channel_name):
+                        if (
+                            config.open_keep_all
+                            or format_channel_name(channel_name) == key
+                        ):
                             info_element = url_element.find_next_sibling()
                             date, resolution = get_channel_info(
                                 info_element.get_text(strip=True)
@@ -350,11 +707,12 @@ def get_results_from_soup_requests(soup, name):
     """
     results = []
     elements = soup.find_all("div", class_="resultplus") if soup else []
+    key = format_channel_name(name)
     for element in elements:
         name_element = element.find("div", class_="channel")
         if name_element:
             channel_name = name_element.get_text(strip=True)
-            if channel_name_is_equal(name, channel_name):
+            if config.open_keep_all or format_channel_name(channel_name) == key:
                 text_list = get_element_child_text_list(element, "div")
                 url = date = resolution = None
                 for text in text_list:
@@ -453,50 +811,75 @@ def get_multicast_channel_info(text):
     return date, region, type
 
 
-def init_info_data(data, cate, name):
+class ChannelStore(dict):
     """
-    Init channel info data
+    Channel data of category -> channel name -> candidate list, indexed by the
+    pure url of each channel to skip the duplicates
     """
-    if data.get(cate) is None:
-        data[cate] = {}
-    if data[cate].get(name) is None:
-        data[cate][name] = []
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.url_index = {}
 
-def append_data_to_info_data(
-    info_data, cate, name, data, origin=None, check=True, insert=False
-):
-    """
-    Append channel data to total info data
-    """
-    init_info_data(info_data, cate, name)
-    urls = [x[0].partition("$")[0] for x in info_data[cate][name] if x[0]]
-    for item in data:
-        try:
-            url, date, resolution, *rest = item
-            url_origin = origin or (rest[0] if rest else None)
-            if not url_origin:
-                continue
-            if url:
-                pure_url = url.partition("$")[0]
-                if pure_url in urls:
+    def get_info_list(self, cate, name):
+        """
+        Get the info list of the channel, create it if not exists
+        """
+        return self.setdefault(cate, {}).setdefault(name, [])
+
+    def get_url_set(self, cate, name):
+        """
+        Get the pure url set of the channel
+        """
+        key = (cate, name)
+        urls = self.url_index.get(key)
+        if urls is None:
+            urls = self.url_index[key] = {
+                candidate.url for candidate in self.get_info_list(cate, name)
+            }
+        return urls
+
+    def add_info(self, cate, name, candidate, insert=False):
+        """
+        Add the candidate to the channel if the pure url not exists
+        """
+        info_list = self.get_info_list(cate, name)
+        urls = self.get_url_set(cate, name)
+        if candidate.url in urls:
+            return False
+        if insert:
+            info_list.insert(0, candidate)
+        else:
+            info_list.append(candidate)
+        urls.add(candidate.url)
+        return True
+
+    def append_info_list(self, cate, name, data, origin=None, check=True, insert=False):
+        """
+        Append the channel data of candidates or info tuples to the channel, the
+        insert data is placed at the front in reverse order
+        """
+        info_list = self.get_info_list(cate, name)
+        urls = self.get_url_set(cate, name)
+        front = []
+        for item in data:
+            try:
+                candidate = Candidate.from_info(item, origin=origin)
+                if not candidate.origin or not candidate.url:
+                    continue
+                if candidate.url in urls:
                     continue
                 if (
-                    url_origin == "important"
+                    candidate.origin == "important"
                     or (not check)
-                    or (check and check_url_by_patterns(pure_url))
+                    or check_candidate_by_patterns(candidate)
                 ):
-                    if insert:
-                        info_data[cate][name].insert(
-                            0, (url, date, resolution, url_origin)
-                        )
-                    else:
-                        info_data[cate][name].append(
-                            (url, date, resolution, url_origin)
-                        )
-                    urls.append(pure_url)
-        except:
-            continue
+                    (front if insert else info_list).append(candidate)
+                    urls.add(candidate.url)
+            except:
+                continue
+        if front:
+            info_list[:0] = front[::-1]
 
 
 def get_origin_method_name(method):
@@ -510,12 +893,7 @@ def append_old_data_to_info_data(info_data, cate, name, data):
     """
     Append history channel data to total info data
     """
-    append_data_to_info_data(
-        info_data,
-        cate,
-        name,
-        data,
-    )
+    info_data.append_info_list(cate, name, data)
     print("History:", len(data), end=", ")
 
 
@@ -550,8 +928,12 @@ def append_total_data(
                     if not origin_method:
                         continue
                     name_results = get_channel_results_by_name(name, result)
-                    append_data_to_info_data(
-                        data, cate, name, name_results, origin=origin_method
+                    data.append_info_list(
+                        cate,
+                        name,
+                        name_results,
+                        origin=origin_method,
+                        check=not isinstance(name_results, MulticastCandidateList),
                     )
                     print(f"{method.capitalize()}:", len(name_results), end=", ")
             print(
@@ -575,8 +957,12 @@ def append_total_data(
                             append_old_data_to_info_data(
                                 data, extra_cate, name, old_info_list
                             )
-                    append_data_to_info_data(
-                        data, extra_cate, name, urls, origin=origin_method
+                    data.append_info_list(
+                        extra_cate,
+                        name,
+                        urls,
+                        origin=origin_method,
+                        check=not isinstance(urls, MulticastCandidateList),
                     )
                     print(name, f"{method.capitalize()}:", len(urls), end=", ")
                     print(
@@ -585,37 +971,6 @@ def append_total_data(
                     )
 
 
-async def sort_channel_list(
-    cate,
-    name,
-    info_list,
-    semaphore,
-    ffmpeg=False,
-    ipv6_proxy=None,
-    callback=None,
-):
-    """
-    Sort the channel list
-    """
-    async with semaphore:
-        data = []
-        try:
-            if info_list:
-                sorted_data = await sort_urls_by_speed_and_resolution(
-                    info_list, ffmpeg=ffmpeg, ipv6_proxy=ipv6_proxy, callback=callback
-                )
-                if sorted_data:
-                    for (url, date, resolution, origin), response_time in sorted_data:
-                        logging.info(
-                            f"Name: {name}, URL: {url}, Date: {date}, Resolution: {resolution}, Response Time: {response_time} ms"
-                        )
-                        data.append((url, date, resolution, origin))
-        except Exception as e:
-            logging.error(f"Error: {e}")
-        finally:
-            return {"cate": cate, "name": name, "data": data}
-
-
 async def process_sort_channel_list(data, ipv6=False, callback=None):
     """
     Processs the sort channel list
@@ -625,74 +980,93 @@ async def process_sort_channel_list(data, ipv6=False, callback=None):
     if config.open_ffmpeg and not ffmpeg_installed:
         print("FFmpeg is not installed, using requests for sorting.")
     is_ffmpeg = config.open_ffmpeg and ffmpeg_installed
-    semaphore = asyncio.Semaphore(5)
-    need_sort_data = copy.deepcopy(data)
-    process_nested_dict(need_sort_data, seen=set(), flag=r"cache:(.*)", force_str="!")
-    tasks = [
-        asyncio.create_task(
-            sort_channel_list(
-                cate,
-                name,
-                info_list,
-                semaphore,
-                ffmpeg=is_ffmpeg,
-                ipv6_proxy=ipv6_proxy,
-                callback=callback,
+    open_host_probe = config.open_sort_host_probe
+    load_speed_cache()
+    need_sort_data = get_unique_candidates(data)
+    host_samples = get_host_samples(need_sort_data) if open_host_probe else {}
+    if config.open_sort_prefilter:
+        await filter_by_connect_speed(
+            need_sort_data, ipv6_proxy=ipv6_proxy, callback=callback
+        )
+    session = get_speed_session()
+    try:
+        if host_samples:
+            await filter_by_udpxy_status(
+                need_sort_data, host_samples, session=session, callback=callback
             )
+        sort_results = await sort_channel_data_by_speed(
+            need_sort_data,
+            ffmpeg=is_ffmpeg,
+            ipv6_proxy=ipv6_proxy,
+            callback=callback,
+            session=session,
+            ipv6=ipv6,
         )
-        for cate, channel_obj in need_sort_data.items()
-        for name, info_list in channel_obj.items()
-    ]
-    sort_results = await asyncio.gather(*tasks)
-    sort_data = {}
-    for result in sort_results:
-        if result:
-            cate, name, result_data = result["cate"], result["name"], result["data"]
-            append_data_to_info_data(sort_data, cate, name, result_data, check=False)
-    for cate, obj in data.items():
-        for name, info_list in obj.items():
-            sort_info_list = sort_data.get(cate, {}).get(name, [])
-            sort_urls = {
-                remove_cache_info(sort_url[0])
-                for sort_url in sort_info_list
-                if sort_url and sort_url[0]
-            }
-            for url, date, resolution, origin in info_list:
-                if "$" in url:
-                    info = url.partition("$")[2]
-                    if info and info.startswith("!"):
-                        append_data_to_info_data(
-                            sort_data,
-                            cate,
-                            name,
-                            [(url, date, resolution, origin)],
-                            check=False,
-                            insert=True,
+        if host_samples:
+            update_host_speed_cache(sort_results, host_samples)
+        sort_data = ChannelStore()
+        for cate, channel_obj in sort_results.items():
+            for name, sorted_data in channel_obj.items():
+                result_data = []
+                for candidate, response_time in sorted_data:
+                    logging.info(
+                        f"Name: {name}, URL: {candidate.get_url()}, Date: {candidate.date}, Resolution: {candidate.resolution}, Response Time: {response_time} ms"
+                    )
+                    result_data.append(candidate)
+                sort_data.append_info_list(cate, name, result_data, check=False)
+        host_data = {}
+        for cate, obj in data.items():
+            for name, info_list in obj.items():
+                sort_urls = sort_data.get_url_set(cate, name)
+                host_list = []
+                for candidate in info_list:
+                    if candidate.important:
+                        sort_data.append_info_list(
+                            cate, name, [candidate], check=False, insert=True
                         )
                         continue
-                    matcher = re.search(r"cache:(.*)", info)
-                    if matcher:
-                        cache_key = matcher.group(1)
-                        if not cache_key:
-                            continue
-                        url = remove_cache_info(url)
-                        if url in sort_urls or cache_key not in speed_cache:
-                            continue
-                        cache = speed_cache[cache_key]
-                        if not cache:
-                            continue
-                        response_time, resolution = cache
-                        if response_time and response_time != float("inf"):
-                            append_data_to_info_data(
-                                sort_data,
-                                cate,
-                                name,
-                                [(url, date, resolution, origin)],
-                                check=False,
-                            )
-                            logging.info(
-                                f"Name: {name}, URL: {url}, Date: {date}, Resolution: {resolution}, Response Time: {response_time} ms"
+                    cache_key = candidate.cache
+                    if (
+                        not cache_key
+                        or candidate.url in sort_urls
+                        or cache_key not in speed_cache
+                    ):
+                        continue
+                    cache = speed_cache[cache_key]
+                    if not cache:
+                        continue
+                    response_time, resolution, throughput = cache
+                    if response_time and response_time != float("inf"):
+                        host_list.append(
+                            candidate.copy(
+                                cache=None,
+                                resolution=resolution,
+                                speed=response_time,
+                                throughput=throughput,
                             )
+                        )
+                if host_list:
+                    host_data[(cate, name)] = (
+                        len(sort_data.get_info_list(cate, name)),
+                        host_list,
+                    )
+        if open_host_probe and config.open_sort_host_full_check and host_data:
+            host_results = await check_host_candidates(
+                host_data, ffmpeg=is_ffmpeg, ipv6_proxy=ipv6_proxy, session=session
+            )
+        else:
+            host_results = {
+                key: host_list for key, (_, host_list) in host_data.items()
+            }
+        for (cate, name), host_list in host_results.items():
+            sort_data.append_info_list(cate, name, host_list, check=False)
+            for candidate in host_list:
+                logging.info(
+                    f"Name: {name}, URL: {candidate.get_url()}, Date: {candidate.date}, Resolution: {candidate.resolution}, Response Time: {candidate.speed} ms"
+                )
+    finally:
+        await close_speed_session()
+        save_speed_cache()
     return sort_data
 
 
@@ -700,42 +1074,46 @@ def write_channel_to_file(data, ipv6=False, callback=None):
     """
     Write channel to file
     """
-    path = "output/result_new.txt"
-    if config.open_update_time:
-        now = datetime.datetime.now()
-        if os.environ.get("GITHUB_ACTIONS"):
-            now += datetime.timedelta(hours=8)
-        update_time = now.strftime("%Y-%m-%d %H:%M:%S")
-        write_content_into_txt(f"更新时间,#genre#", path, newline=False)
-        write_content_into_txt(f"{update_time},url", path)
-    no_result_name = []
-    open_empty_category = config.open_empty_category
-    for cate, channel_obj in data.items():
-        print(f"\n{cate}:", end=" ")
-        write_content_into_txt(f"{cate},#genre#", path)
-        channel_obj_keys = channel_obj.keys()
-        names_len = len(list(channel_obj_keys))
-        for i, name in enumerate(channel_obj_keys):
-            info_list = data.get(cate, {}).get(name, [])
-            channel_urls = get_total_urls_from_info_list(info_list, ipv6=ipv6)
-            end_char = ", " if i < names_len - 1 else ""
-            print(f"{name}:", len(channel_urls), end=end_char)
-            if not channel_urls:
-                if open_empty_category:
-                    no_result_name.append(name)
-                continue
-            for url in channel_urls:
-                write_content_into_txt(f"{name},{url}", path, callback=callback)
-        print()
-        write_content_into_txt("", path)
-    if open_empty_category and no_result_name:
-        print("\n🈳 No result channel name:")
-        write_content_into_txt("🈳无结果频道,#genre#", path)
-        for i, name in enumerate(no_result_name):
-            end_char = ", " if i < len(no_result_name) - 1 else ""
-            print(name, end=end_char)
-            write_content_into_txt(f"{name},url", path)
-        print()
+    path = resource_path(config.final_file, persistent=True)
+    with ResultWriter(path) as writer:
+        if config.open_update_time:
+            now = datetime.datetime.now()
+            if os.environ.get("GITHUB_ACTIONS"):
+                now += datetime.timedelta(hours=8)
+            update_time = now.strftime("%Y-%m-%d %H:%M:%S")
+            writer.write_category("更新时间")
+            writer.write_channel(update_time, ["url"])
+        no_result_name = []
+        open_empty_category = config.open_empty_category
+        for cate, channel_obj in data.items():
+            print(f"\n{cate}:", end=" ")
+            writer.write_category(cate)
+            channel_obj_keys = channel_obj.keys()
+            names_len = len(list(channel_obj_keys))
+            for i, name in enumerate(channel_obj_keys):
+                info_list = data.get(cate, {}).get(name, [])
+                channel_urls = get_total_urls_from_info_list(info_list, ipv6=ipv6)
+                end_char = ", " if i < names_len - 1 else ""
+                print(f"{name}:", len(channel_urls), end=end_char)
+                if not channel_urls:
+                    if open_empty_category:
+                        no_result_name.append(name)
+                    continue
+                writer.write_channel(name, channel_urls)
+                if callback:
+                    for _ in channel_urls:
+                        callback()
+            print()
+            writer.write_blank()
+        if open_empty_category and no_result_name:
+            print("\n🈳 No result channel name:")
+            writer.write_category("🈳无结果频道")
+            for i, name in enumerate(no_result_name):
+                end_char = ", " if i < len(no_result_name) - 1 else ""
+                print(name, end=end_char)
+                writer.write_channel(name, ["url"])
+            print()
+    print(f"✅ Result files generated at: {', '.join(writer.paths)}")
 
 
 def get_multicast_fofa_search_org(region, type):
@@ -785,31 +1163,17 @@ def get_multicast_fofa_search_urls():
 
 def get_channel_data_cache_with_compare(data, new_data):
     """
-    Get channel data with cache compare new data
+    Get channel data with cache compare new data, the channel lists are replaced
+    instead of changed in place
     """
     for cate, obj in new_data.items():
         for name, url_info in obj.items():
             if url_info and cate in data and name in data[cate]:
                 new_urls = {
-                    new_url.partition("$")[0]: new_resolution
-                    for new_url, _, new_resolution, _ in url_info
+                    candidate.url: candidate.resolution for candidate in url_info
                 }
-                updated_data = []
-                for info in data[cate][name]:
-                    url, date, resolution, origin = info
-                    base_url = url.partition("$")[0]
-                    if base_url in new_urls:
-                        resolution = new_urls[base_url]
-                        updated_data.append((url, date, resolution, origin))
-                data[cate][name] = updated_data
-
-
-def format_channel_url_info(data):
-    """
-    Format channel url info, remove cache, add resolution to url
-    """
-    for obj in data.values():
-        for url_info in obj.values():
-            for i, (url, date, resolution, origin) in enumerate(url_info):
-                url = remove_cache_info(url)
-                url_info[i] = (url, date, resolution, origin)
+                data[cate][name] = [
+                    candidate.copy(resolution=new_urls[candidate.url])
+                    for candidate in data[cate][name]
+                    if candidate.url in new_urls
+                ]
@@ -161,6 +161,10 @@ class ConfigManager:
     def source_file(self):
         return self.config.get("Settings", "source_file", fallback="config/demo.txt")
 
+    @property
+    def alias_file(self):
+        return self.config.get("Settings", "alias_file", fallback="config/alias.txt")
+
     @property
     def final_file(self):
         return self.config.get("Settings", "final_file", fallback="output/result.txt")
@@ -264,6 +268,100 @@ class ConfigManager:
     def sort_timeout(self):
         return self.config.getint("Settings", "sort_timeout", fallback=10)
 
+    @property
+    def sort_workers(self):
+        return self.config.getint("Settings", "sort_workers", fallback=100)
+
+    @property
+    def open_sort_early_stop(self):
+        return self.config.getboolean(
+            "Settings", "open_sort_early_stop", fallback=False
+        )
+
+    @property
+    def sort_connection_limit(self):
+        return self.config.getint("Settings", "sort_connection_limit", fallback=100)
+
+    @property
+    def sort_limit_per_host(self):
+        return self.config.getint("Settings", "sort_limit_per_host", fallback=10)
+
+    @property
+    def sort_probe_size(self):
+        return self.config.getint("Settings", "sort_probe_size", fallback=512)
+
+    @property
+    def open_m3u8_probe(self):
+        return self.config.getboolean("Settings", "open_m3u8_probe", fallback=True)
+
+    @property
+    def open_ffprobe(self):
+        return self.config.getboolean("Settings", "open_ffprobe", fallback=True)
+
+    @property
+    def sort_process_limit(self):
+        return self.config.getint("Settings", "sort_process_limit", fallback=0)
+
+    @property
+    def open_sort_prefilter(self):
+        return self.config.getboolean("Settings", "open_sort_prefilter", fallback=True)
+
+    @property
+    def sort_prefilter_timeout(self):
+        return self.config.getfloat("Settings", "sort_prefilter_timeout", fallback=3)
+
+    @property
+    def sort_prefilter_top_k(self):
+        return self.config.getint("Settings", "sort_prefilter_top_k", fallback=0)
+
+    @property
+    def sort_host_failure_limit(self):
+        return self.config.getint("Settings", "sort_host_failure_limit", fallback=2)
+
+    @property
+    def sort_host_cooldown(self):
+        return self.config.getint("Settings", "sort_host_cooldown", fallback=300)
+
+    @property
+    def open_sort_host_probe(self):
+        return self.config.getboolean(
+            "Settings", "open_sort_host_probe", fallback=False
+        )
+
+    @property
+    def sort_host_sample_num(self):
+        return self.config.getint("Settings", "sort_host_sample_num", fallback=2)
+
+    @property
+    def open_sort_host_full_check(self):
+        return self.config.getboolean(
+            "Settings", "open_sort_host_full_check", fallback=False
+        )
+
+    @property
+    def speed_cache_ttl(self):
+        return self.config.getfloat("Settings", "speed_cache_ttl", fallback=12)
+
+    @property
+    def speed_cache_fail_ttl(self):
+        return self.config.getfloat("Settings", "speed_cache_fail_ttl", fallback=6)
+
+    @property
+    def open_subscribe_cache(self):
+        return self.config.getboolean(
+            "Settings", "open_subscribe_cache", fallback=True
+        )
+
+    @property
+    def subscribe_connection_limit(self):
+        return self.config.getint(
+            "Settings", "subscribe_connection_limit", fallback=100
+        )
+
+    @property
+    def subscribe_limit_per_host(self):
+        return self.config.getint("Settings", "subscribe_limit_per_host", fallback=5)
+
     @property
     def open_proxy(self):
         return self.config.getboolean("Settings", "open_proxy", fallback=False)
@@ -296,11 +394,15 @@ class ConfigManager:
 
     @property
     def response_time_weight(self):
-        return self.config.getfloat("Settings", "response_time_weight", fallback=0.5)
+        return self.config.getfloat("Settings", "response_time_weight", fallback=0.4)
 
     @property
     def resolution_weight(self):
-        return self.config.getfloat("Settings", "resolution_weight", fallback=0.5)
+        return self.config.getfloat("Settings", "resolution_weight", fallback=0.4)
+
+    @property
+    def throughput_weight(self):
+        return self.config.getfloat("Settings", "throughput_weight", fallback=0.2)
 
     @property
     def open_empty_category(self):
@@ -356,8 +458,13 @@ class ConfigManager:
             if os.path.exists(user_config_path)
             else default_config_path
         )
+        user_alias_file = resource_path(
+            self.config.get("Settings", "alias_file", fallback="config/alias.txt")
+        )
         dest_folder = os.path.join(os.getcwd(), "config")
         files_to_copy = [user_source_file, user_config_file]
+        if os.path.exists(user_alias_file):
+            files_to_copy.append(user_alias_file)
         try:
             if os.path.exists(dest_folder):
                 if not os.path.isdir(dest_folder):
@@ -6,6 +6,18 @@ log_file = "result_new.log"
 
 log_path = os.path.join(output_dir, log_file)
 
+speed_cache_path = os.path.join(output_dir, "speed_cache.pkl")
+
+subscribe_cache_path = os.path.join(output_dir, "subscribe_cache.pkl")
+
+multicast_rtp_cache_path = os.path.join(output_dir, "multicast_rtp_cache.pkl")
+
+result_cache_path = os.path.join(output_dir, "result_cache.pkl")
+
+result_history_path = os.path.join(output_dir, "result_history.db")
+
+result_history_expire_runs = 10
+
 url_pattern = r"((https?):\/\/)?(\[[0-9a-fA-F:]+\]|([\w-]+\.)+[\w-]+)(:[0-9]{1,5})?(\/[^\s]*)?(\$[^\s]+)?"
 
 rtp_pattern = r"^([^,，]+)(?:[,，])?(rtp://.*)$"
@@ -52,6 +64,8 @@ replace_dict = {
     "CCTV17农业": "CCTV17",
 }
 
+channel_name_cache_size = 65536
+
 region_list = [
     "广东",
     "北京",
@@ -95,4 +109,28 @@ foodie_url = "http://www.foodieguide.com/iptvsearch/"
 
 foodie_hotel_url = "http://www.foodieguide.com/iptvsearch/hoteliptv.php"
 
+sort_dns_cache_ttl = 300
+
+sort_keepalive_timeout = 30
+
+m3u8_max_size = 1024 * 1024
+
+ffprobe_probesize = 500000
+
+ffprobe_analyzeduration = 1000000
+
+scheme_port = {"http": 80, "https": 443, "rtsp": 554, "rtmp": 1935}
+
+sort_prefilter_concurrency = 500
+
+sort_process_per_cpu = 4
+
+m3u_header = '#EXTM3U x-tvg-url="https://live.fanmingming.com/e.xml"'
+
+m3u_logo_url = "https://live.fanmingming.com/tv/"
+
 waiting_tip = "🔍️正在更新，请耐心等待更新完成..."
+
+subscribe_chunk_size = 64 * 1024
+
+subscribe_cache_expire = 7 * 24 * 3600
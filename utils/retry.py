@@ -1,4 +1,5 @@
 from time import sleep
+import asyncio
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 from selenium.common.exceptions import TimeoutException
@@ -25,6 +26,24 @@ def retry_func(func, retries=max_retries, name=""):
     raise Exception(f"Failed to connect to the {name} reached the maximum retries.")
 
 
+async def retry_async_func(func, retries=max_retries, name=""):
+    """
+    Retry the async function
+    """
+    for i in range(retries):
+        try:
+            await asyncio.sleep(1)
+            return await func()
+        except Exception as e:
+            if name and i < retries - 1:
+                print(f"Failed to connect to the {name}. Retrying {i+1}...")
+            elif i == retries - 1:
+                raise Exception(
+                    f"Failed to connect to the {name} reached the maximum retries."
+                )
+    raise Exception(f"Failed to connect to the {name} reached the maximum retries.")
+
+
 def locate_element_with_retry(
     driver, locator, timeout=config.request_timeout, retries=max_retries
 ):
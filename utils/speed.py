@@ -3,31 +3,538 @@ from time import time
 import asyncio
 import re
 from utils.config import config
-from utils.tools import is_ipv6, add_url_info, remove_cache_info, get_resolution_value
+import utils.constants as constants
+from utils.tools import (
+    get_resolution_value,
+    get_url_host,
+    resource_path,
+)
 import subprocess
+from urllib.parse import urljoin, urlparse
+from functools import lru_cache
+import json
+import os
+import pickle
+from collections import defaultdict, deque
+from itertools import zip_longest
 
+speed_session = None
+speed_session_loop = None
+process_semaphore = None
+process_semaphore_loop = None
 
-async def get_speed(url, timeout=config.sort_timeout, proxy=None):
+
+def get_speed_session():
+    """
+    Get the shared speed test session, create it for the running loop if needed
+    """
+    global speed_session, speed_session_loop
+    loop = asyncio.get_running_loop()
+    if (
+        speed_session is None
+        or speed_session.closed
+        or speed_session_loop is not loop
+    ):
+        speed_session = ClientSession(
+            connector=TCPConnector(
+                ssl=False,
+                limit=config.sort_connection_limit,
+                limit_per_host=config.sort_limit_per_host,
+                ttl_dns_cache=constants.sort_dns_cache_ttl,
+                keepalive_timeout=constants.sort_keepalive_timeout,
+            ),
+            trust_env=True,
+        )
+        speed_session_loop = loop
+    return speed_session
+
+
+async def close_speed_session():
+    """
+    Close the shared speed test session
+    """
+    global speed_session, speed_session_loop
+    if speed_session is not None and not speed_session.closed:
+        await speed_session.close()
+    speed_session = None
+    speed_session_loop = None
+
+
+host_health = {}
+
+
+def get_host_key(url):
+    """
+    Get the host:port key of the url for the host health table
+    """
+    host = get_url_host(url)
+    return f"{host[0]}:{host[1]}" if host else None
+
+
+def update_host_health(url, available):
+    """
+    Update the host health of the url, open the circuit breaker of the host
+    when the failures reach the limit
+    """
+    key = get_host_key(url)
+    if key is None:
+        return
+    if available:
+        host_health.pop(key, None)
+    else:
+        failures, _ = host_health.get(key, (0, 0))
+        host_health[key] = (failures + 1, time() + config.sort_host_cooldown)
+
+
+def is_host_available(url):
+    """
+    Check if the host of the url is available, a host whose circuit breaker is
+    open is skipped until the cooldown expires, then one probe is let through
+    """
+    key = get_host_key(url)
+    health = host_health.get(key)
+    if health is None:
+        return True
+    failures, retry_time = health
+    if failures < config.sort_host_failure_limit:
+        return True
+    if time() >= retry_time:
+        host_health[key] = (failures, time() + config.sort_host_cooldown)
+        return True
+    return False
+
+
+async def get_speed_info(
+    url, timeout=config.sort_timeout, proxy=None, session=None, probe_size=None
+):
+    """
+    Get the speed info of the url by reading only the head of the response,
+    return the time to first byte (ms), the throughput (KB/s) and the read size,
+    the probe size defaults to sort_probe_size, 0 reads the whole response,
+    requests through a proxy are left out of the host health table
+    """
+    session = session or get_speed_session()
+    if probe_size is None:
+        probe_size = config.sort_probe_size * 1024
+    start = time()
+    first_byte = None
+    size = 0
+    response_received = False
+    try:
+        async with session.get(url, timeout=timeout, proxy=proxy) as response:
+            response_received = True
+            if not proxy:
+                update_host_health(url, True)
+            if response.status == 404:
+                return None
+            async for chunk in response.content.iter_any():
+                if first_byte is None:
+                    first_byte = time()
+                size += len(chunk)
+                if probe_size and size >= probe_size:
+                    response.close()
+                    break
+    except Exception as e:
+        if not response_received and not proxy:
+            update_host_health(url, False)
+        return None
+    if not size:
+        return None
+    end = time()
+    return {
+        "delay": int(round((first_byte - start) * 1000)),
+        "speed": round(size / 1024 / max(end - start, 0.001), 2),
+        "size": size,
+    }
+
+
+async def get_speed(url, timeout=config.sort_timeout, proxy=None, session=None):
+    """
+    Get the time to first byte of the url
+    """
+    info = await get_speed_info(url, timeout=timeout, proxy=proxy, session=session)
+    return info["delay"] if info else float("inf")
+
+
+m3u8_attribute_pattern = re.compile(r'([A-Z0-9-]+)=("[^"]*"|[^,]*)')
+
+
+def is_m3u8_url(url):
+    """
+    Check if the url is a m3u8 playlist
+    """
+    return ".m3u8" in urlparse(url).path.lower()
+
+
+def get_m3u8_attributes(line):
+    """
+    Get the attributes of the m3u8 tag line
+    """
+    return {
+        key: value.strip('"')
+        for key, value in m3u8_attribute_pattern.findall(line.partition(":")[2])
+    }
+
+
+def parse_m3u8_playlist(content, base_url):
+    """
+    Parse the m3u8 playlist, return the variant streams and the media segments
+    """
+    variants = []
+    segments = []
+    variant = None
+    duration = None
+    for line in content.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        if line.startswith("#EXT-X-STREAM-INF"):
+            attributes = get_m3u8_attributes(line)
+            bandwidth = attributes.get("BANDWIDTH", "")
+            variant = {
+                "bandwidth": int(bandwidth) if bandwidth.isdigit() else None,
+                "resolution": attributes.get("RESOLUTION"),
+            }
+        elif line.startswith("#EXTINF"):
+            try:
+                duration = float(line.partition(":")[2].partition(",")[0])
+            except ValueError:
+                duration = None
+        elif not line.startswith("#"):
+            url = urljoin(base_url, line)
+            if variant is not None:
+                variant["url"] = url
+                variants.append(variant)
+                variant = None
+            elif duration is not None:
+                segments.append((url, duration))
+                duration = None
+    return variants, segments
+
+
+def get_m3u8_variant(variants):
     """
-    Get the speed of the url
+    Get the variant with the lowest resolution that meets the min resolution,
+    otherwise the one with the highest resolution
     """
-    async with ClientSession(
-        connector=TCPConnector(verify_ssl=False), trust_env=True
-    ) as session:
+    min_resolution_value = config.min_resolution_value
+
+    def variant_key(variant):
+        resolution = variant["resolution"]
+        return (
+            get_resolution_value(resolution) if resolution else 0,
+            variant["bandwidth"] or 0,
+        )
+
+    sorted_variants = sorted(variants, key=variant_key)
+    for variant in sorted_variants:
+        if variant_key(variant)[0] >= min_resolution_value:
+            return variant
+    return sorted_variants[-1]
+
+
+async def get_url_content(url, timeout=config.sort_timeout, session=None):
+    """
+    Get the text content of the url, limited to the max playlist size
+    """
+    session = session or get_speed_session()
+    chunks = []
+    size = 0
+    response_received = False
+    try:
+        response = await session.get(url, timeout=timeout)
+        response_received = True
+    finally:
+        update_host_health(url, response_received)
+    async with response:
+        if response.status != 200:
+            return None
+        async for chunk in response.content.iter_any():
+            chunks.append(chunk)
+            size += len(chunk)
+            if size >= constants.m3u8_max_size:
+                response.close()
+                break
+    return b"".join(chunks).decode("utf-8", errors="ignore")
+
+
+async def get_m3u8_info(
+    url, timeout=config.sort_timeout, session=None, segment_num=2
+):
+    """
+    Get the m3u8 info by walking the playlist and downloading the latest segments,
+    return the playlist delay (ms), the segment throughput (KB/s), the ratio of
+    segment duration to download time, and the bandwidth and resolution of the variant
+    """
+    session = session or get_speed_session()
+
+    async def walk_playlist():
         start = time()
-        end = None
-        try:
-            async with session.get(url, timeout=timeout, proxy=proxy) as response:
-                if response.status == 404:
-                    return float("inf")
-                content = await response.read()
-                if content:
-                    end = time()
+        content = await get_url_content(url, timeout=timeout, session=session)
+        if not content or "#EXTM3U" not in content:
+            return None
+        delay = int(round((time() - start) * 1000))
+        bandwidth = resolution = None
+        variants, segments = parse_m3u8_playlist(content, url)
+        if variants:
+            variant = get_m3u8_variant(variants)
+            bandwidth, resolution = variant["bandwidth"], variant["resolution"]
+            content = await get_url_content(
+                variant["url"], timeout=timeout, session=session
+            )
+            if not content:
+                return None
+            _, segments = parse_m3u8_playlist(content, variant["url"])
+        if not segments:
+            return None
+        total_size = total_duration = total_time = 0
+        for segment_url, duration in segments[-segment_num:]:
+            segment_start = time()
+            info = await get_speed_info(
+                segment_url, timeout=timeout, session=session, probe_size=0
+            )
+            if not info:
+                return None
+            total_time += time() - segment_start
+            total_size += info["size"]
+            total_duration += duration
+        total_time = max(total_time, 0.001)
+        return {
+            "delay": delay,
+            "speed": round(total_size / 1024 / total_time, 2),
+            "ratio": round(total_duration / total_time, 2),
+            "bandwidth": bandwidth,
+            "resolution": resolution,
+        }
+
+    try:
+        return await asyncio.wait_for(walk_playlist(), timeout=timeout)
+    except Exception:
+        return None
+
+
+def get_m3u8_speed(m3u8_info):
+    """
+    Get the response time of the m3u8 info, slowed down when the segments
+    can not be downloaded in real time
+    """
+    delay = m3u8_info["delay"]
+    ratio = m3u8_info["ratio"]
+    return delay if ratio >= 1 else int(round(delay / max(ratio, 0.01)))
+
+
+async def get_connect_speed(host, port, timeout=config.sort_prefilter_timeout):
+    """
+    Get the tcp connect time (ms) of the host
+    """
+    start = time()
+    try:
+        _, writer = await asyncio.wait_for(
+            asyncio.open_connection(host, port), timeout=timeout
+        )
+    except Exception:
+        return float("inf")
+    end = time()
+    writer.close()
+    try:
+        await writer.wait_closed()
+    except Exception:
+        pass
+    return int(round((end - start) * 1000))
+
+
+async def filter_by_connect_speed(data, ipv6_proxy=None, callback=None):
+    """
+    Filter the channel data by tcp connect speed before the stream analysis,
+    remove the unreachable urls and keep the fastest top k urls of each channel
+    """
+    hosts = {
+        candidate.host
+        for channel_obj in data.values()
+        for info_list in channel_obj.values()
+        for candidate in info_list
+        if candidate.cache_key not in speed_cache
+    }
+    hosts.discard(None)
+    semaphore = asyncio.Semaphore(constants.sort_prefilter_concurrency)
+
+    async def connect_task(host):
+        async with semaphore:
+            return host, await get_connect_speed(*host)
+
+    host_speed = dict(await asyncio.gather(*(connect_task(host) for host in hosts)))
+    for (host, port), speed in host_speed.items():
+        if speed == float("inf"):
+            host_health[f"{host}:{port}"] = (
+                config.sort_host_failure_limit,
+                time() + config.sort_host_cooldown,
+            )
+    top_k = config.sort_prefilter_top_k
+    for channel_obj in data.values():
+        for name, info_list in channel_obj.items():
+            passed = []
+            for candidate in info_list:
+                host = candidate.host
+                if (
+                    (ipv6_proxy and candidate.ipv6)
+                    or host not in host_speed
+                    or candidate.cache_key in speed_cache
+                ):
+                    speed = 0
                 else:
-                    return float("inf")
-        except Exception as e:
-            return float("inf")
-        return int(round((end - start) * 1000)) if end else float("inf")
+                    speed = host_speed[host]
+                if speed == float("inf"):
+                    if callback:
+                        callback()
+                    continue
+                passed.append((speed, candidate))
+            if top_k and len(passed) > top_k:
+                fastest = sorted(range(len(passed)), key=lambda i: passed[i][0])
+                for _ in fastest[top_k:]:
+                    if callback:
+                        callback()
+                passed = [passed[i] for i in sorted(fastest[:top_k])]
+            channel_obj[name] = [candidate for _, candidate in passed]
+    return data
+
+
+def get_udpxy_status_url(url):
+    """
+    Get the status page url of the udpxy host of the multicast url
+    """
+    base_url, separator, _ = url.partition("/rtp/")
+    return f"{base_url}/status" if separator else None
+
+
+def get_host_samples(data):
+    """
+    Get the host of each sample of the shared hosts without a cached result, the
+    samples are tested by their own url and the best result is the host result
+    """
+    host_samples = {}
+    for channel_obj in data.values():
+        for info_list in channel_obj.values():
+            for index, candidate in enumerate(info_list):
+                if candidate.cache and candidate.cache not in speed_cache:
+                    host_samples[candidate.url] = candidate.cache
+                    info_list[index] = candidate.copy(cache=None)
+    return host_samples
+
+
+async def filter_by_udpxy_status(data, host_samples, session=None, callback=None):
+    """
+    Filter the samples by the status page of their udpxy host, the hosts that
+    give no response are marked as failed for all their channels
+    """
+    session = session or get_speed_session()
+    status_urls = {}
+    for url, host in host_samples.items():
+        status_url = get_udpxy_status_url(url)
+        if status_url:
+            status_urls.setdefault(host, status_url)
+    semaphore = asyncio.Semaphore(max(config.sort_workers, 1))
+
+    async def status_task(host, status_url):
+        async with semaphore:
+            try:
+                async with session.get(status_url, timeout=config.sort_timeout):
+                    return host, True
+            except Exception:
+                return host, False
+
+    failed_hosts = {
+        host
+        for host, available in await asyncio.gather(
+            *(status_task(host, url) for host, url in status_urls.items())
+        )
+        if not available
+    }
+    for host in failed_hosts:
+        update_speed_cache(host, float("inf"), None)
+    for channel_obj in data.values():
+        for name, info_list in channel_obj.items():
+            passed = []
+            for candidate in info_list:
+                if host_samples.get(candidate.url) in failed_hosts:
+                    if callback:
+                        callback()
+                    continue
+                passed.append(candidate)
+            channel_obj[name] = passed
+    return data
+
+
+def update_host_speed_cache(results, host_samples):
+    """
+    Update the speed cache of the shared hosts with the best result of their
+    tested samples, the hosts whose tested samples all failed are marked as failed
+    """
+    host_results = {}
+    for channel_obj in results.values():
+        for sort_list in channel_obj.values():
+            for item in sort_list:
+                host = host_samples.get(item[0].url)
+                if host and (
+                    host not in host_results
+                    or get_sort_key(item) > get_sort_key(host_results[host])
+                ):
+                    host_results[host] = item
+    tested_hosts = {
+        host for url, host in host_samples.items() if url in speed_cache
+    }
+    for host in tested_hosts:
+        if host in host_results:
+            candidate, speed = host_results[host]
+            update_speed_cache(
+                host, speed, candidate.resolution, candidate.throughput
+            )
+        else:
+            update_speed_cache(host, float("inf"), None)
+
+
+async def check_host_candidates(data, ffmpeg=False, ipv6_proxy=None, session=None):
+    """
+    Test the candidates that got the result of their host by their own url, in
+    order until each channel has enough urls for the urls limit, the failed
+    candidates are removed and the rest are kept untested
+    """
+    session = session or get_speed_session()
+    urls_limit = config.urls_limit
+    semaphore = asyncio.Semaphore(max(config.sort_workers, 1))
+    host_semaphores = defaultdict(
+        lambda: asyncio.Semaphore(max(config.sort_limit_per_host, 1))
+    )
+
+    async def check_task(candidate):
+        async with semaphore:
+            return await get_speed_by_info(
+                candidate,
+                ffmpeg,
+                host_semaphores[candidate.host],
+                ipv6_proxy=ipv6_proxy,
+                session=session,
+            )
+
+    async def check_channel(key, count, candidates):
+        checked = []
+        index = 0
+        while count < urls_limit and index < len(candidates):
+            batch = candidates[index : index + urls_limit - count]
+            index += len(batch)
+            for speed in await asyncio.gather(*(check_task(item) for item in batch)):
+                if speed != float("inf"):
+                    checked.append(speed[0])
+                    count += 1
+        return key, checked + candidates[index:]
+
+    return dict(
+        await asyncio.gather(
+            *(
+                check_channel(key, count, candidates)
+                for key, (count, candidates) in data.items()
+            )
+        )
+    )
 
 
 def is_ffmpeg_installed():
@@ -43,6 +550,43 @@ def is_ffmpeg_installed():
         return False
 
 
+@lru_cache(maxsize=None)
+def is_ffprobe_installed():
+    """
+    Check ffprobe is installed
+    """
+    try:
+        result = subprocess.run(
+            ["ffprobe", "-version"], stdout=subprocess.PIPE, stderr=subprocess.PIPE
+        )
+        return result.returncode == 0
+    except FileNotFoundError:
+        return False
+
+
+def get_process_limit():
+    """
+    Get the limit of the concurrent ffmpeg/ffprobe processes, 0 in the config
+    uses a multiple of the cpu count since the processes mostly wait on the network
+    """
+    limit = config.sort_process_limit
+    if limit <= 0:
+        limit = (os.cpu_count() or 1) * constants.sort_process_per_cpu
+    return max(min(limit, config.sort_workers), 1)
+
+
+def get_process_semaphore():
+    """
+    Get the semaphore that limits the concurrent ffmpeg/ffprobe processes
+    """
+    global process_semaphore, process_semaphore_loop
+    loop = asyncio.get_running_loop()
+    if process_semaphore is None or process_semaphore_loop is not loop:
+        process_semaphore = asyncio.Semaphore(get_process_limit())
+        process_semaphore_loop = loop
+    return process_semaphore
+
+
 async def ffmpeg_url(url, timeout=config.sort_timeout):
     """
     Get url info by ffmpeg
@@ -74,6 +618,63 @@ async def ffmpeg_url(url, timeout=config.sort_timeout):
         return res
 
 
+async def ffprobe_url(url, timeout=config.sort_timeout):
+    """
+    Get url info by ffprobe with a small probe size, return the json output
+    """
+    args = [
+        "ffprobe",
+        "-v",
+        "error",
+        "-probesize",
+        str(constants.ffprobe_probesize),
+        "-analyzeduration",
+        str(constants.ffprobe_analyzeduration),
+        "-select_streams",
+        "v:0",
+        "-show_entries",
+        "stream=codec_name,width,height,avg_frame_rate,bit_rate:format=bit_rate",
+        "-of",
+        "json",
+        url,
+    ]
+    proc = None
+    try:
+        proc = await asyncio.create_subprocess_exec(
+            *args, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
+        )
+        out, _ = await asyncio.wait_for(proc.communicate(), timeout=timeout)
+        if proc.returncode != 0 or not out:
+            return None
+        return json.loads(out.decode("utf-8"))
+    except Exception:
+        if proc and proc.returncode is None:
+            proc.kill()
+            await proc.wait()
+        return None
+
+
+def get_ffprobe_video_info(probe_info):
+    """
+    Get the video info (codec, resolution, fps, bitrate) from the ffprobe output
+    """
+    streams = probe_info.get("streams") or [{}]
+    stream = streams[0]
+    width, height = stream.get("width"), stream.get("height")
+    fps = None
+    frame_rate = stream.get("avg_frame_rate", "")
+    num, _, den = frame_rate.partition("/")
+    if num.isdigit() and den.isdigit() and int(den):
+        fps = round(int(num) / int(den), 2)
+    bitrate = stream.get("bit_rate") or probe_info.get("format", {}).get("bit_rate")
+    return {
+        "codec": stream.get("codec_name"),
+        "resolution": f"{width}x{height}" if width and height else None,
+        "fps": fps,
+        "bitrate": int(bitrate) if str(bitrate).isdigit() else None,
+    }
+
+
 def get_video_info(video_info):
     """
     Get the video info
@@ -91,20 +692,32 @@ def get_video_info(video_info):
     return frame_size, resolution
 
 
-async def check_stream_speed(url_info):
+async def check_stream_speed(candidate):
     """
     Check the stream speed
     """
     try:
-        url = url_info[0]
-        video_info = await ffmpeg_url(url)
+        url = candidate.url
+        if config.open_ffprobe and is_ffprobe_installed():
+            async with get_process_semaphore():
+                start = time()
+                probe_info = await ffprobe_url(url)
+            if probe_info is None:
+                return float("inf")
+            video_info = get_ffprobe_video_info(probe_info)
+            if not video_info["codec"]:
+                return float("inf")
+            candidate.resolution = video_info["resolution"]
+            return (candidate, int(round((time() - start) * 1000)))
+        async with get_process_semaphore():
+            video_info = await ffmpeg_url(url)
         if video_info is None:
             return float("inf")
         frame, resolution = get_video_info(video_info)
         if frame is None or frame == float("inf"):
             return float("inf")
-        url_info[2] = resolution
-        return (url_info, frame)
+        candidate.resolution = resolution
+        return (candidate, frame)
     except Exception as e:
         print(e)
         return float("inf")
@@ -112,54 +725,123 @@ async def check_stream_speed(url_info):
 
 speed_cache = {}
 
+speed_cache_info = {}
+
+
+def load_speed_cache():
+    """
+    Load the unexpired speed results of previous runs from the speed cache file
+    """
+    speed_cache_path = resource_path(constants.speed_cache_path)
+    if not os.path.exists(speed_cache_path):
+        return
+    try:
+        with open(speed_cache_path, "rb") as file:
+            cache = pickle.load(file)
+    except Exception:
+        return
+    now = time()
+    ttl = config.speed_cache_ttl * 3600
+    fail_ttl = config.speed_cache_fail_ttl * 3600
+    for key, (speed, resolution, *throughput, timestamp, failures) in cache.items():
+        expire = fail_ttl * failures if speed == float("inf") else ttl
+        speed_cache_info[key] = (timestamp, failures)
+        if key not in speed_cache and now - timestamp < expire:
+            speed_cache[key] = (speed, resolution, *(throughput or [None]))
+
+
+def update_speed_cache(key, speed, resolution, throughput=None):
+    """
+    Update the speed cache with a new speed result
+    """
+    speed_cache[key] = (speed, resolution, throughput)
+    _, failures = speed_cache_info.get(key, (None, 0))
+    speed_cache_info[key] = (
+        time(),
+        failures + 1 if speed == float("inf") else 0,
+    )
+
+
+def save_speed_cache():
+    """
+    Save the speed results with time and failure count to the speed cache file
+    """
+    if not config.speed_cache_ttl and not config.speed_cache_fail_ttl:
+        return
+    cache = {
+        key: (*speed_cache[key], timestamp, failures)
+        for key, (timestamp, failures) in speed_cache_info.items()
+        if key in speed_cache
+    }
+    speed_cache_path = resource_path(constants.speed_cache_path, persistent=True)
+    os.makedirs(os.path.dirname(speed_cache_path), exist_ok=True)
+    tmp_path = f"{speed_cache_path}.tmp"
+    with open(tmp_path, "wb") as file:
+        pickle.dump(cache, file)
+    os.replace(tmp_path, speed_cache_path)
+
 
 async def get_speed_by_info(
-    url_info, ffmpeg, semaphore, ipv6_proxy=None, callback=None
+    candidate, ffmpeg, semaphore, ipv6_proxy=None, callback=None, session=None
 ):
     """
-    Get the info with speed
+    Get the candidate with speed
     """
     async with semaphore:
-        url, _, resolution, _ = url_info
-        url_info = list(url_info)
-        cache_key = None
-        url_is_ipv6 = is_ipv6(url)
-        if "$" in url:
-            url, _, cache_info = url.partition("$")
-            matcher = re.search(r"cache:(.*)", cache_info)
-            if matcher:
-                cache_key = matcher.group(1)
-            url_show_info = remove_cache_info(cache_info)
-        url_info[0] = url
-        if cache_key in speed_cache:
-            speed = speed_cache[cache_key][0]
-            url_info[2] = speed_cache[cache_key][1]
-            if speed != float("inf"):
-                if url_show_info:
-                    url_info[0] = add_url_info(url, url_show_info)
-                return (tuple(url_info), speed)
-            else:
-                return float("inf")
+        cache_key = candidate.cache_key
+        candidate = candidate.copy(cache=None)
+        url = candidate.url
+        url_is_ipv6 = candidate.ipv6
+        resolution = candidate.resolution
+        throughput = None
         try:
+            if cache_key in speed_cache:
+                speed, candidate.resolution, candidate.throughput = speed_cache[
+                    cache_key
+                ]
+                if speed != float("inf"):
+                    candidate.speed = speed
+                    return (candidate, speed)
+                else:
+                    return float("inf")
             if ipv6_proxy and url_is_ipv6:
                 url_speed = 0
-                speed = (url_info, url_speed)
+                speed = (candidate, url_speed)
+            elif not is_host_available(url):
+                return float("inf")
+            elif config.open_m3u8_probe and is_m3u8_url(url):
+                m3u8_info = await get_m3u8_info(url, session=session)
+                if m3u8_info:
+                    url_speed = get_m3u8_speed(m3u8_info)
+                    resolution = m3u8_info["resolution"] or resolution
+                    throughput = m3u8_info["speed"]
+                    candidate.resolution = resolution
+                    speed = (candidate, url_speed)
+                else:
+                    url_speed = speed = float("inf")
             elif ffmpeg:
-                speed = await check_stream_speed(url_info)
+                speed = await check_stream_speed(candidate)
                 url_speed = speed[1] if speed != float("inf") else float("inf")
-                if url_speed == float("inf"):
-                    url_speed = await get_speed(url)
-                resolution = speed[0][2] if speed != float("inf") else None
+                resolution = speed[0].resolution if speed != float("inf") else None
             else:
-                url_speed = await get_speed(url)
+                info = await get_speed_info(url, session=session)
+                url_speed = info["delay"] if info else float("inf")
+                throughput = info["speed"] if info else None
                 speed = (
-                    (url_info, url_speed) if url_speed != float("inf") else float("inf")
+                    (candidate, url_speed)
+                    if url_speed != float("inf")
+                    else float("inf")
                 )
-            if cache_key and cache_key not in speed_cache:
-                speed_cache[cache_key] = (url_speed, resolution)
-            if url_show_info:
-                speed[0][0] = add_url_info(speed[0][0], url_show_info)
-            speed = (tuple(speed[0]), speed[1])
+            if speed == float("inf"):
+                url_speed = float("inf")
+            if cache_key not in speed_cache:
+                if ipv6_proxy and url_is_ipv6:
+                    speed_cache[cache_key] = (url_speed, resolution, throughput)
+                else:
+                    update_speed_cache(cache_key, url_speed, resolution, throughput)
+            if speed != float("inf"):
+                speed[0].speed = speed[1]
+                speed[0].throughput = throughput
             return speed
         except:
             return float("inf")
@@ -168,30 +850,151 @@ async def get_speed_by_info(
                 callback()
 
 
-async def sort_urls_by_speed_and_resolution(
-    data, ffmpeg=False, ipv6_proxy=None, callback=None
-):
+def get_sort_key(item):
     """
-    Sort by speed and resolution
+    Get the combined sort key of the speed result by response time, resolution
+    and throughput
     """
-    semaphore = asyncio.Semaphore(20)
-    response = await asyncio.gather(
+    candidate, response_time = item
+    resolution = candidate.resolution
+    resolution_value = get_resolution_value(resolution) if resolution else 0
+    return (
+        -(config.response_time_weight * response_time)
+        + config.resolution_weight * resolution_value
+        + config.throughput_weight * (candidate.throughput or 0)
+    )
+
+
+def get_sort_priority(candidate, ipv_type_prefer):
+    """
+    Get the sort priority of the candidate, the urls with cached results, the
+    preferred origin and the preferred ipv type are tested first
+    """
+    origin = candidate.origin
+    if origin == "subscribe" and "/rtp/" in candidate.url:
+        origin = "multicast"
+    origin_type_prefer = config.origin_type_prefer
+    ipv_type = "ipv6" if candidate.ipv6 else "ipv4"
+    return (
+        0 if candidate.cache_key in speed_cache else 1,
+        (
+            origin_type_prefer.index(origin)
+            if origin in origin_type_prefer
+            else len(origin_type_prefer)
+        ),
+        (
+            ipv_type_prefer.index(ipv_type)
+            if ipv_type in ipv_type_prefer
+            else len(ipv_type_prefer)
+        ),
+    )
+
+
+def get_sort_queue(data, ipv6=False):
+    """
+    Get the sort queue of the channel data, the urls of each channel are ordered
+    by priority and the urls of all channels are interleaved in turn so that
+    every channel makes progress fairly
+    """
+    ipv_type_prefer = list(config.ipv_type_prefer)
+    if "自动" in ipv_type_prefer or "auto" in ipv_type_prefer or not ipv_type_prefer:
+        ipv_type_prefer = ["ipv6", "ipv4"] if ipv6 else ["ipv4", "ipv6"]
+    queue = asyncio.Queue()
+    info_lists = [
+        ((cate, name), info_list)
+        for cate, channel_obj in data.items()
+        for name, info_list in channel_obj.items()
+    ]
+    for items in zip_longest(
         *(
-            get_speed_by_info(
-                url_info, ffmpeg, semaphore, ipv6_proxy=ipv6_proxy, callback=callback
-            )
-            for url_info in data
+            [
+                (key, candidate)
+                for candidate in sorted(
+                    info_list,
+                    key=lambda item: get_sort_priority(item, ipv_type_prefer),
+                )
+            ]
+            for key, info_list in info_lists
         )
+    ):
+        for item in items:
+            if item is not None:
+                queue.put_nowait(item)
+    return queue
+
+
+def is_good_speed_result(speed):
+    """
+    Check if the speed result is valid and meets the min resolution
+    """
+    if speed == float("inf"):
+        return False
+    resolution = speed[0].resolution
+    return not (
+        config.open_filter_resolution
+        and resolution
+        and get_resolution_value(resolution) < config.min_resolution_value
     )
-    valid_response = [res for res in response if res != float("inf")]
 
-    def combined_key(item):
-        (_, _, resolution, _), response_time = item
-        resolution_value = get_resolution_value(resolution) if resolution else 0
-        return (
-            -(config.response_time_weight * response_time)
-            + config.resolution_weight * resolution_value
+
+async def sort_channel_data_by_speed(
+    data, ffmpeg=False, ipv6_proxy=None, callback=None, session=None, ipv6=False
+):
+    """
+    Sort the urls of all channels by speed and resolution through one global
+    work queue, with a fixed number of workers and a concurrency limit per host,
+    the urls of a saturated host are deferred to the workers testing that host
+    so that other workers keep going, in early stop mode the remaining urls of
+    a channel are skipped once enough good urls are found
+    """
+    session = session or get_speed_session()
+    queue = get_sort_queue(data, ipv6=ipv6)
+    open_sort_early_stop = config.open_sort_early_stop
+    urls_limit = config.urls_limit
+    good_count = defaultdict(int)
+    results = {
+        cate: {name: [] for name in channel_obj}
+        for cate, channel_obj in data.items()
+    }
+    host_semaphores = defaultdict(
+        lambda: asyncio.Semaphore(max(config.sort_limit_per_host, 1))
+    )
+
+    host_waiting = defaultdict(deque)
+
+    async def sort_item(key, candidate):
+        if open_sort_early_stop and good_count[key] >= urls_limit:
+            if callback:
+                callback()
+            return
+        speed = await get_speed_by_info(
+            candidate,
+            ffmpeg,
+            host_semaphores[candidate.host],
+            ipv6_proxy=ipv6_proxy,
+            callback=callback,
+            session=session,
         )
+        cate, name = key
+        if speed != float("inf"):
+            results[cate][name].append(speed)
+        if is_good_speed_result(speed):
+            good_count[key] += 1
+
+    async def sort_worker():
+        while not queue.empty():
+            key, candidate = queue.get_nowait()
+            host = candidate.host
+            if host_semaphores[host].locked():
+                host_waiting[host].append((key, candidate))
+                continue
+            await sort_item(key, candidate)
+            while host_waiting[host] and not host_semaphores[host].locked():
+                await sort_item(*host_waiting[host].popleft())
 
-    sorted_res = sorted(valid_response, key=combined_key, reverse=True)
-    return sorted_res
+    worker_num = min(max(config.sort_workers, 1), queue.qsize())
+    await asyncio.gather(*(sort_worker() for _ in range(worker_num)))
+    for channel_obj in results.values():
+        for sort_list in channel_obj.values():
+            sort_list.sort(key=get_sort_key, reverse=True)
+    return results
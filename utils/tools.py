@@ -9,10 +9,19 @@ from utils.config import config
 import utils.constants as constants
 import re
 from bs4 import BeautifulSoup
-from flask import render_template_string, send_file
+from flask import render_template_string, request, Response
 import shutil
 import requests
 import sys
+from functools import lru_cache
+import gzip
+import hashlib
+import mimetypes
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
 
 
 def format_interval(t):
@@ -136,39 +145,36 @@ def get_total_urls_from_info_list(infoList, ipv6=False):
     }
 
     total_urls = []
-    for url, _, resolution, origin in infoList:
+    for candidate in infoList:
+        origin = candidate.origin
         if not origin:
             continue
 
         if origin == "important":
-            im_url, _, im_info = url.partition("$")
-            im_info_value = im_info.partition("!")[2]
-            total_urls.append(f"{im_url}${im_info_value}" if im_info_value else im_url)
+            total_urls.append(
+                f"{candidate.url}${candidate.info}" if candidate.info else candidate.url
+            )
             continue
 
-        if origin == "subscribe" and "/rtp/" in url:
+        if origin == "subscribe" and "/rtp/" in candidate.url:
             origin = "multicast"
 
         if origin not in origin_type_prefer:
             continue
 
+        resolution = candidate.resolution
         if config.open_filter_resolution and resolution:
             resolution_value = get_resolution_value(resolution)
             if resolution_value < config.min_resolution_value:
                 continue
 
-        pure_url, _, info = url.partition("$")
-        if not info:
-            origin_name = constants.origin_map[origin]
-            if origin_name:
-                url = add_url_info(pure_url, origin_name)
-
-        url_is_ipv6 = is_ipv6(url)
-        if url_is_ipv6:
-            url = add_url_info(url, "IPv6")
-
-        if resolution:
-            url = add_url_info(url, resolution)
+        url_is_ipv6 = candidate.ipv6
+        infos = [
+            candidate.info or constants.origin_map[origin],
+            "IPv6" if url_is_ipv6 else None,
+            resolution,
+        ]
+        url = f"{candidate.url}${'|'.join(info for info in infos if info)}"
 
         if url_is_ipv6:
             categorized_urls[origin]["ipv6"].append(url)
@@ -264,7 +270,13 @@ def check_url_ipv_type(url):
     """
     Check if the url is compatible with the ipv type in the config
     """
-    ipv6 = is_ipv6(url)
+    return check_ipv_type(is_ipv6(url))
+
+
+def check_ipv_type(ipv6):
+    """
+    Check if the ipv6 or ipv4 url is compatible with the ipv type in the config
+    """
     ipv_type = config.ipv_type
     return (
         (ipv_type == "ipv4" and not ipv6)
@@ -288,6 +300,15 @@ def check_url_by_patterns(url):
     return check_url_ipv_type(url) and check_by_url_keywords_blacklist(url)
 
 
+def check_candidate_by_patterns(candidate):
+    """
+    Check the candidate by patterns, reuse the ipv6 check of the candidate
+    """
+    return check_ipv_type(candidate.ipv6) and check_by_url_keywords_blacklist(
+        candidate.url
+    )
+
+
 def filter_urls_by_patterns(urls):
     """
     Filter urls by patterns
@@ -297,34 +318,74 @@ def filter_urls_by_patterns(urls):
     return urls
 
 
-def merge_objects(*objects):
+class OrderedSet(dict):
     """
-    Merge objects
+    Ordered set of the list items in the accumulated result
     """
 
-    def merge_dicts(dict1, dict2):
-        for key, value in dict2.items():
-            if key in dict1:
-                if isinstance(dict1[key], dict) and isinstance(value, dict):
-                    merge_dicts(dict1[key], value)
-                elif isinstance(dict1[key], set):
-                    dict1[key].update(value)
-                elif isinstance(dict1[key], list):
-                    if value:
-                        dict1[key].extend(value)
-                        dict1[key] = list(set(dict1[key]))
-                elif value:
-                    dict1[key] = {dict1[key], value}
-            else:
-                dict1[key] = value
 
-    merged_dict = {}
-    for obj in objects:
+class ResultAccumulator:
+    """
+    Accumulate the fetched results in place, deduplicating the list values
+    while keeping the first seen order
+    """
+
+    def __init__(self):
+        self.data = {}
+
+    def copy_value(self, value):
+        if isinstance(value, dict):
+            return self.merge({}, value)
+        if isinstance(value, (list, set)):
+            return OrderedSet.fromkeys(value)
+        return value
+
+    def merge(self, target, source):
+        for key, value in source.items():
+            if key not in target:
+                target[key] = self.copy_value(value)
+                continue
+            current = target[key]
+            if isinstance(current, OrderedSet):
+                if value:
+                    current.update(dict.fromkeys(value))
+            elif isinstance(current, dict) and isinstance(value, dict):
+                self.merge(current, value)
+            elif value:
+                target[key] = OrderedSet.fromkeys((current, value))
+        return target
+
+    def update(self, obj):
+        """
+        Merge the object into the result
+        """
         if not isinstance(obj, dict):
             raise TypeError("All input objects must be dictionaries")
-        merge_dicts(merged_dict, obj)
+        self.merge(self.data, obj)
+        return self
+
+    def get_value(self, value):
+        if isinstance(value, OrderedSet):
+            return list(value)
+        if isinstance(value, dict):
+            return {key: self.get_value(item) for key, item in value.items()}
+        return value
+
+    def result(self):
+        """
+        Get the accumulated result as dicts and lists
+        """
+        return self.get_value(self.data)
+
 
-    return merged_dict
+def merge_objects(*objects):
+    """
+    Merge objects
+    """
+    accumulator = ResultAccumulator()
+    for obj in objects:
+        accumulator.update(obj)
+    return accumulator.result()
 
 
 def get_ip_address():
@@ -342,94 +403,90 @@ def get_ip_address():
     return f"http://{IP}:8000"
 
 
-def convert_to_m3u():
-    """
-    Convert result txt to m3u format
-    """
-    user_final_file = resource_path(config.final_file)
-    if os.path.exists(user_final_file):
-        with open(user_final_file, "r", encoding="utf-8") as file:
-            m3u_output = '#EXTM3U x-tvg-url="https://live.fanmingming.com/e.xml"\n'
-            current_group = None
-            for line in file:
-                trimmed_line = line.strip()
-                if trimmed_line != "":
-                    if "#genre#" in trimmed_line:
-                        current_group = trimmed_line.replace(",#genre#", "").strip()
-                    else:
-                        try:
-                            original_channel_name, _, channel_link = map(
-                                str.strip, trimmed_line.partition(",")
-                            )
-                        except:
-                            continue
-                        processed_channel_name = re.sub(
-                            r"(CCTV|CETV)-(\d+)(\+.*)?",
-                            lambda m: f"{m.group(1)}{m.group(2)}"
-                            + ("+" if m.group(3) else ""),
-                            original_channel_name,
-                        )
-                        m3u_output += f'#EXTINF:-1 tvg-name="{processed_channel_name}" tvg-logo="https://live.fanmingming.com/tv/{processed_channel_name}.png"'
-                        if current_group:
-                            m3u_output += f' group-title="{current_group}"'
-                        m3u_output += f",{original_channel_name}\n{channel_link}\n"
-            m3u_file_path = os.path.splitext(user_final_file)[0] + ".m3u"
-            with open(m3u_file_path, "w", encoding="utf-8") as m3u_file:
-                m3u_file.write(m3u_output)
-            print(f"✅ Result m3u file generated at: {m3u_file_path}")
+result_template = "<head><link rel='icon' href='{{ url_for('static', filename='images/favicon.ico') }}' type='image/x-icon'></head><pre>{{ content }}</pre>"
 
+result_content_cache = {}
 
-def get_result_file_content(show_result=False):
+
+def get_result_content_cache(path, show_result=False):
     """
-    Get the content of the result file
+    Get the in-memory cache of the result file with precompressed copies,
+    reload it only when the file is updated
     """
-    user_final_file = resource_path(config.final_file)
-    if os.path.exists(user_final_file):
-        if config.open_m3u_result:
-            user_final_file = os.path.splitext(user_final_file)[0] + ".m3u"
-            if show_result == False:
-                return send_file(user_final_file, as_attachment=True)
-        with open(user_final_file, "r", encoding="utf-8") as file:
-            content = file.read()
+    stat = os.stat(path)
+    key = (path, show_result)
+    cache = result_content_cache.get(key)
+    if cache and cache["mtime"] == stat.st_mtime_ns and cache["size"] == stat.st_size:
+        return cache
+    with open(path, "rb") as file:
+        body = file.read()
+    if show_result:
+        body = render_template_string(
+            result_template, content=body.decode("utf-8")
+        ).encode("utf-8")
+        mimetype = "text/html"
     else:
-        content = constants.waiting_tip
-    return render_template_string(
-        "<head><link rel='icon' href='{{ url_for('static', filename='images/favicon.ico') }}' type='image/x-icon'></head><pre>{{ content }}</pre>",
-        content=content,
-    )
+        mimetype = mimetypes.guess_type(path)[0] or "application/octet-stream"
+    etag = hashlib.md5(body).hexdigest()
+    encodings = {None: body, "gzip": gzip.compress(body)}
+    if brotli:
+        encodings["br"] = brotli.compress(body)
+    cache = {
+        "mtime": stat.st_mtime_ns,
+        "size": stat.st_size,
+        "last_modified": int(stat.st_mtime),
+        "etag": etag,
+        "mimetype": mimetype,
+        "encodings": encodings,
+    }
+    result_content_cache[key] = cache
+    return cache
 
 
-def remove_duplicates_from_tuple_list(tuple_list, seen, flag=None, force_str=None):
+def get_cached_response(cache, attachment=None):
     """
-    Remove duplicates from tuple list
+    Get the response of the cached result content, compressed by the accepted
+    encoding and answered with 304 when the client copy is still valid
     """
-    unique_list = []
-    for item in tuple_list:
-        item_first = item[0]
-        part = item_first
-        if force_str:
-            info = item_first.partition("$")[2]
-            if info and info.startswith(force_str):
-                continue
-        if flag:
-            matcher = re.search(flag, item_first)
-            if matcher:
-                part = matcher.group(1)
-        if part not in seen:
-            seen.add(part)
-            unique_list.append(item)
-    return unique_list
+    encoding = next(
+        (
+            encoding
+            for encoding in ("br", "gzip")
+            if encoding in cache["encodings"]
+            and request.accept_encodings.quality(encoding) > 0
+        ),
+        None,
+    )
+    response = Response(cache["encodings"][encoding], mimetype=cache["mimetype"])
+    if encoding:
+        response.content_encoding = encoding
+    response.set_etag(f"{cache['etag']}-{encoding}" if encoding else cache["etag"])
+    response.last_modified = cache["last_modified"]
+    response.vary.add("Accept-Encoding")
+    response.cache_control.no_cache = True
+    if attachment:
+        response.headers.set("Content-Disposition", "attachment", filename=attachment)
+    return response.make_conditional(request)
 
 
-def process_nested_dict(data, seen, flag=None, force_str=None):
+def get_result_file_content(show_result=False):
     """
-    Process nested dict
+    Get the content of the result file
     """
-    for key, value in data.items():
-        if isinstance(value, dict):
-            process_nested_dict(value, seen, flag, force_str)
-        elif isinstance(value, list):
-            data[key] = remove_duplicates_from_tuple_list(value, seen, flag, force_str)
+    user_final_file = resource_path(config.final_file)
+    if os.path.exists(user_final_file):
+        if config.open_m3u_result:
+            user_final_file = os.path.splitext(user_final_file)[0] + ".m3u"
+        if os.path.exists(user_final_file):
+            attachment = config.open_m3u_result and not show_result
+            cache = get_result_content_cache(
+                user_final_file, show_result=not attachment
+            )
+            return get_cached_response(
+                cache,
+                attachment=os.path.basename(user_final_file) if attachment else None,
+            )
+    return render_template_string(result_template, content=constants.waiting_tip)
 
 
 url_domain_pattern = re.compile(
@@ -447,6 +504,21 @@ def get_url_domain(url):
     return None
 
 
+def get_url_host(url):
+    """
+    Get the (host, port) of the url, None if the scheme is unknown
+    """
+    try:
+        parsed = urlparse(url)
+        host = parsed.hostname
+        port = parsed.port or constants.scheme_port.get(parsed.scheme)
+    except ValueError:
+        return None
+    if not host or not port:
+        return None
+    return host, port
+
+
 def add_url_info(url, info):
     """
     Add url info to the URL
@@ -465,11 +537,162 @@ def format_url_with_cache(url, cache=None):
     return add_url_info(url, f"cache:{cache}") if cache else url
 
 
-def remove_cache_info(str):
+class Candidate:
     """
-    Remove the cache info from the string
+    Candidate url of the channel with the parsed info, the url string with the
+    info is only built for the output, the stored candidates are shared by the
+    channel data of each stage and never changed in place, use copy to update
     """
-    return re.sub(r"cache:.*|\|cache:.*", "", str)
+
+    __slots__ = (
+        "url",
+        "info",
+        "cache",
+        "date",
+        "resolution",
+        "origin",
+        "important",
+        "speed",
+        "throughput",
+        "_host",
+        "_ipv6",
+    )
+
+    def __init__(
+        self,
+        url,
+        info=None,
+        cache=None,
+        date=None,
+        resolution=None,
+        origin=None,
+        important=False,
+        speed=None,
+        throughput=None,
+        ipv6=None,
+    ):
+        self.url = url
+        self.info = info
+        self.cache = cache
+        self.date = date
+        self.resolution = resolution
+        self.origin = origin
+        self.important = important
+        self.speed = speed
+        self.throughput = throughput
+        self._host = None
+        self._ipv6 = ipv6
+
+    def __repr__(self):
+        return f"Candidate({self.get_url(cache=True)!r}, {self.origin!r})"
+
+    @classmethod
+    def from_info(cls, info, origin=None):
+        """
+        Get the candidate from the candidate or the (url$info, date, resolution,
+        origin) tuple, the origin overrides the one of the info
+        """
+        if isinstance(info, cls):
+            if origin and origin != info.origin:
+                return info.copy(origin=origin)
+            return info
+        url, date, resolution, *rest = info
+        pure_url, _, url_info = url.partition("$")
+        important = url_info.startswith("!")
+        if important:
+            url_info = url_info[1:]
+        url_info, _, cache = url_info.partition("cache:")
+        return cls(
+            pure_url,
+            info=url_info.rstrip("|") or None,
+            cache=cache or None,
+            date=date,
+            resolution=resolution,
+            origin=origin or (rest[0] if rest else None),
+            important=important,
+        )
+
+    def copy(self, **kwargs):
+        """
+        Copy the candidate with the updated fields
+        """
+        candidate = Candidate(
+            self.url,
+            info=self.info,
+            cache=self.cache,
+            date=self.date,
+            resolution=self.resolution,
+            origin=self.origin,
+            important=self.important,
+            speed=self.speed,
+            throughput=self.throughput,
+        )
+        for key, value in kwargs.items():
+            setattr(candidate, key, value)
+        return candidate
+
+    @property
+    def cache_key(self):
+        """
+        The speed cache key, the cache info or the pure url
+        """
+        return self.cache or self.url
+
+    @property
+    def host(self):
+        """
+        The (host, port) of the url
+        """
+        if self._host is None:
+            self._host = get_url_host(self.url) or ()
+        return self._host or None
+
+    @property
+    def ipv6(self):
+        if self._ipv6 is None:
+            self._ipv6 = is_ipv6(self.url)
+        return self._ipv6
+
+    def get_url(self, *infos, cache=False):
+        """
+        Get the url string with the info and the extra infos
+        """
+        infos = [self.info, *infos]
+        if cache and self.cache:
+            infos.append(f"cache:{self.cache}")
+        info = "|".join(item for item in infos if item)
+        if self.important:
+            info = f"!{info}"
+        return f"{self.url}${info}" if info else self.url
+
+
+def get_unique_candidates(data):
+    """
+    Get the nested channel data of the candidates to be sorted, skip the important
+    candidates and keep the first candidate of each speed cache key, or the first
+    samples of each shared host in the host probe mode
+    """
+    sample_num = config.sort_host_sample_num if config.open_sort_host_probe else 1
+    seen = set()
+    samples = {}
+    unique_data = {}
+    for cate, channel_obj in data.items():
+        unique_data[cate] = {}
+        for name, info_list in channel_obj.items():
+            unique_list = unique_data[cate][name] = []
+            for candidate in info_list:
+                if candidate.important:
+                    continue
+                if candidate.cache:
+                    count = samples.get(candidate.cache, 0)
+                    if count >= sample_num or (count and candidate.url in seen):
+                        continue
+                    samples[candidate.cache] = count + 1
+                elif candidate.url in seen:
+                    continue
+                seen.add(candidate.url)
+                unique_list.append(candidate)
+    return unique_data
 
 
 def resource_path(relative_path, persistent=False):
@@ -488,18 +711,177 @@ def resource_path(relative_path, persistent=False):
             return total_path
 
 
-def write_content_into_txt(content, path=None, newline=True, callback=None):
+m3u_tvg_name_pattern = re.compile(r"(CCTV|CETV)-(\d+)(\+.*)?")
+
+
+@lru_cache(maxsize=None)
+def get_m3u_tvg_name(name):
     """
-    Write content into txt file
+    Get the m3u tvg name of the channel name, e.g. CCTV-5+体育 -> CCTV5+
     """
-    if not path:
-        return
+    return m3u_tvg_name_pattern.sub(
+        lambda m: f"{m.group(1)}{m.group(2)}" + ("+" if m.group(3) else ""), name
+    )
 
-    with open(path, "a", encoding="utf-8") as f:
-        if newline:
-            f.write(f"\n{content}")
-        else:
-            f.write(content)
 
-    if callback:
-        callback()
+class TxtResultFormat:
+    """
+    Txt result format, lines are separated by newline without a trailing one
+    """
+
+    suffix = ".txt"
+    trailing_newline = False
+
+    def header(self):
+        return []
+
+    def category(self, category):
+        return [f"{category},#genre#"]
+
+    def channel(self, name, urls, group=None):
+        return [f"{name},{url}" for url in urls]
+
+    def blank(self):
+        return [""]
+
+
+class M3uResultFormat:
+    """
+    M3u result format with tvg name, logo and group title
+    """
+
+    suffix = ".m3u"
+    trailing_newline = True
+
+    def header(self):
+        return [constants.m3u_header]
+
+    def category(self, category):
+        return []
+
+    def channel(self, name, urls, group=None):
+        tvg_name = get_m3u_tvg_name(name)
+        group_title = f' group-title="{group}"' if group else ""
+        extinf = f'#EXTINF:-1 tvg-name="{tvg_name}" tvg-logo="{constants.m3u_logo_url}{tvg_name}.png"{group_title},{name}'
+        return [line for url in urls for line in (extinf, url)]
+
+    def blank(self):
+        return []
+
+
+result_formats = {
+    "txt": TxtResultFormat,
+    "m3u": M3uResultFormat,
+}
+
+
+class ResultWriter:
+    """
+    Buffered result writer, render every result format in the same pass from
+    the channel data and move the files into place atomically when closed
+    """
+
+    def __init__(self, path, formats=("txt", "m3u"), buffer_size=1000):
+        self.buffer_size = buffer_size
+        self.outputs = []
+        for name in formats:
+            result_format = result_formats[name]()
+            output_path = (
+                path
+                if name == "txt"
+                else os.path.splitext(path)[0] + result_format.suffix
+            )
+            self.outputs.append(
+                {
+                    "format": result_format,
+                    "path": output_path,
+                    "file": None,
+                    "buffer": [],
+                    "written": False,
+                }
+            )
+        self.buffer_len = 0
+        self.group = None
+
+    @property
+    def paths(self):
+        return [output["path"] for output in self.outputs]
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close(commit=exc_type is None)
+
+    def open(self):
+        """
+        Open the temporary result files and write the headers
+        """
+        for output in self.outputs:
+            os.makedirs(os.path.dirname(output["path"]) or ".", exist_ok=True)
+            output["file"] = open(f"{output['path']}.tmp", "w", encoding="utf-8")
+            output["buffer"].extend(output["format"].header())
+
+    def write(self, render):
+        """
+        Render the lines of every format and buffer them
+        """
+        for output in self.outputs:
+            lines = render(output["format"])
+            output["buffer"].extend(lines)
+            self.buffer_len += len(lines)
+        if self.buffer_len >= self.buffer_size:
+            self.flush()
+
+    def write_category(self, category):
+        """
+        Write the category, the following channels belong to this group
+        """
+        self.group = category
+        self.write(lambda result_format: result_format.category(category))
+
+    def write_channel(self, name, urls):
+        """
+        Write the urls of the channel
+        """
+        group = self.group
+        self.write(lambda result_format: result_format.channel(name, urls, group))
+
+    def write_blank(self):
+        """
+        Write a blank line between categories
+        """
+        self.write(lambda result_format: result_format.blank())
+
+    def flush(self):
+        """
+        Flush the buffered lines into the temporary result files
+        """
+        for output in self.outputs:
+            if output["buffer"]:
+                prefix = "\n" if output["written"] else ""
+                output["file"].write(prefix + "\n".join(output["buffer"]))
+                output["buffer"] = []
+                output["written"] = True
+        self.buffer_len = 0
+
+    def close(self, commit=True):
+        """
+        Close the result files, replace the final files with the temporary
+        files if commit, otherwise remove the temporary files
+        """
+        if commit:
+            self.flush()
+        for output in self.outputs:
+            file, path = output["file"], output["path"]
+            if not file:
+                continue
+            if commit and output["written"] and output["format"].trailing_newline:
+                file.write("\n")
+            file.close()
+            output["file"] = None
+            if commit:
+                os.replace(f"{path}.tmp", path)
+            elif os.path.exists(f"{path}.tmp"):
+                os.remove(f"{path}.tmp")